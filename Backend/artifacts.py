@@ -0,0 +1,256 @@
+"""
+Per-document artifact store keyed by content hash.
+
+The analysis endpoints (/api/classify, /api/summarize, /api/ask-doc-query) are
+often called one after another with the same upload. Everything derived from
+a document - extracted text, chunk boundaries, chunk embeddings, the
+classification and the summary - is stored under the upload's SHA-256 and
+computed only when first needed, so the second and third calls neither parse
+nor embed the document again.
+
+Two tiers: an in-memory LRU bounded by ARTIFACT_MEMORY_MB, backed by files
+under ARTIFACT_DIR/<hash[:2]>/<hash>/ bounded by ARTIFACT_DISK_MB (whole
+documents are evicted least-recently-used first). Documents not read or
+written for ARTIFACT_TTL_DAYS are also removed from disk (0 disables), so
+extracted text of one-off uploads does not linger up to the size cap.
+"""
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "./artifact_cache")
+ARTIFACT_MEMORY_MB = int(os.getenv("ARTIFACT_MEMORY_MB", "256"))
+ARTIFACT_DISK_MB = int(os.getenv("ARTIFACT_DISK_MB", "2048"))
+ARTIFACT_TTL_DAYS = float(os.getenv("ARTIFACT_TTL_DAYS", "30"))
+# How often a write re-scans the disk tier for expired documents
+_SWEEP_INTERVAL_S = 3600
+
+_MISSING = object()
+
+
+def _size_of(value: Any) -> int:
+    """Approximate resident size of an artifact in bytes."""
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    if isinstance(value, str):
+        return len(value)
+    return len(json.dumps(value))
+
+
+class ArtifactStore:
+    def __init__(self, directory: str = ARTIFACT_DIR, memory_budget_mb: int = ARTIFACT_MEMORY_MB,
+                 disk_budget_mb: int = ARTIFACT_DISK_MB, ttl_days: float = ARTIFACT_TTL_DAYS):
+        self.directory = directory
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.disk_budget = disk_budget_mb * 1024 * 1024
+        self.ttl_s = ttl_days * 86400
+        self._last_sweep = 0.0
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[Any, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # scanned on first write
+        self._lock = threading.RLock()
+        # (hash, name) -> [lock, waiters]: one computation per artifact at a time
+        self._inflight: Dict[Tuple[str, str], list] = {}
+        self._async_inflight: Dict[Tuple[str, str], list] = {}
+        metrics.gauge("artifact_memory_bytes", fn=lambda: self._memory_bytes)
+
+    # ---------- Public API ----------
+    def get(self, doc_hash: str, name: str, default: Any = None) -> Any:
+        """Returns a stored artifact from memory or disk, or `default`."""
+        key = (doc_hash, name)
+        value = self._from_memory(key)
+        if value is not _MISSING:
+            return value
+        value = self._load(doc_hash, name)
+        metrics.record_cache(f"artifact_{name}", value is not _MISSING)
+        if value is _MISSING:
+            return default
+        self._remember(key, value)
+        return value
+
+    def put(self, doc_hash: str, name: str, value: Any):
+        self._remember((doc_hash, name), value)
+        try:
+            self._persist(doc_hash, name, value)
+        except OSError as e:
+            # The disk tier is best-effort; the artifact is still served from memory
+            metrics.counter("artifact_write_errors_total").inc()
+            print(f"⚠️ Could not persist artifact {name} of {doc_hash[:12]}: {e}")
+
+    def get_or_compute(self, doc_hash: str, name: str, compute: Callable[[], Any]) -> Any:
+        """Returns the artifact, computing and storing it first if it does not exist.
+
+        Concurrent callers for the same artifact wait for a single computation.
+        Exceptions from `compute` propagate and nothing is stored. Each call
+        counts as exactly one cache hit or miss.
+        """
+        key = (doc_hash, name)
+        value = self._from_memory(key)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            slot = self._inflight.setdefault(key, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                value = self.get(doc_hash, name, _MISSING)
+                if value is _MISSING:
+                    value = compute()
+                    self.put(doc_hash, name, value)
+                return value
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._inflight[key]
+
+    async def get_or_compute_async(self, doc_hash: str, name: str,
+                                   compute: Callable[[], Awaitable[Any]]) -> Any:
+        """get_or_compute for coroutine computations (e.g. Gemini calls queued on the event loop).
+
+        Store lookups and writes run in a thread; concurrent callers for the
+        same artifact await a single computation.
+        """
+        key = (doc_hash, name)
+        slot = self._async_inflight.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                value = await asyncio.to_thread(self.get, doc_hash, name, _MISSING)
+                if value is _MISSING:
+                    value = await compute()
+                    await asyncio.to_thread(self.put, doc_hash, name, value)
+                return value
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._async_inflight[key]
+
+    # ---------- Memory tier ----------
+    def _from_memory(self, key: Tuple[str, str]) -> Any:
+        """Memory-tier lookup; records a hit, but not a miss (the caller goes on to disk)."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return _MISSING
+            self._memory.move_to_end(key)
+        metrics.record_cache(f"artifact_{key[1]}", True)
+        return entry[0]
+
+    def _remember(self, key: Tuple[str, str], value: Any):
+        size = _size_of(value)
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= old[1]
+            if size > self.memory_budget:
+                return
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_budget:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted
+                metrics.counter("artifact_evictions_total", {"tier": "memory", "reason": "size"}).inc()
+
+    # ---------- Disk tier ----------
+    def _doc_dir(self, doc_hash: str) -> str:
+        return os.path.join(self.directory, doc_hash[:2], doc_hash)
+
+    def _load(self, doc_hash: str, name: str) -> Any:
+        doc_dir = self._doc_dir(doc_hash)
+        base = os.path.join(doc_dir, name)
+        try:
+            with metrics.stage("artifact_load"):
+                if os.path.exists(base + ".npy"):
+                    import numpy as np
+                    value = np.load(base + ".npy")
+                elif os.path.exists(base + ".txt"):
+                    with open(base + ".txt", encoding="utf-8") as f:
+                        value = f.read()
+                elif os.path.exists(base + ".json"):
+                    with open(base + ".json", encoding="utf-8") as f:
+                        value = json.load(f)
+                else:
+                    return _MISSING
+            os.utime(doc_dir)  # recency for disk eviction
+            return value
+        except (OSError, ValueError):
+            # Evicted concurrently or a torn file: treat as missing and recompute
+            return _MISSING
+
+    def _persist(self, doc_hash: str, name: str, value: Any):
+        doc_dir = self._doc_dir(doc_hash)
+        os.makedirs(doc_dir, exist_ok=True)
+        if hasattr(value, "nbytes"):
+            import numpy as np
+            path = os.path.join(doc_dir, name + ".npy")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, value)
+        else:
+            ext = ".txt" if isinstance(value, str) else ".json"
+            path = os.path.join(doc_dir, name + ext)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                if isinstance(value, str):
+                    f.write(value)
+                else:
+                    json.dump(value, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._disk_bytes is None or time.time() - self._last_sweep > _SWEEP_INTERVAL_S:
+                # First write, or time for a TTL sweep: rescan (this also enforces the size cap)
+                self._evict_disk(keep=doc_hash)
+            else:
+                self._disk_bytes += os.path.getsize(path)
+                if self._disk_bytes > self.disk_budget:
+                    self._evict_disk(keep=doc_hash)
+
+    def _scan(self) -> List[Tuple[str, int, float]]:
+        """(doc dir, bytes, last access) for every document on disk."""
+        docs = []
+        if not os.path.isdir(self.directory):
+            return docs
+        for prefix in os.listdir(self.directory):
+            prefix_dir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for doc_hash in os.listdir(prefix_dir):
+                doc_dir = os.path.join(prefix_dir, doc_hash)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(doc_dir))
+                    docs.append((doc_dir, size, os.path.getmtime(doc_dir)))
+                except OSError:
+                    continue
+        return docs
+
+    def _evict_disk(self, keep: str):
+        """Removes expired documents, then least-recently-used ones until under the disk budget."""
+        now = time.time()
+        self._last_sweep = now
+        docs = sorted(self._scan(), key=lambda d: d[2])
+        self._disk_bytes = sum(size for _, size, _ in docs)
+        for doc_dir, size, last_access in docs:
+            if os.path.basename(doc_dir) == keep:
+                continue
+            if self.ttl_s and now - last_access > self.ttl_s:
+                reason = "ttl"
+            elif self._disk_bytes > self.disk_budget:
+                reason = "size"
+            else:
+                break
+            shutil.rmtree(doc_dir, ignore_errors=True)
+            self._disk_bytes -= size
+            metrics.counter("artifact_evictions_total", {"tier": "disk", "reason": reason}).inc()
+
+
+# Global artifact store shared by the analysis endpoints
+artifact_store = ArtifactStore()
@@ -258,20 +258,138 @@
 
 #---------------------------------------------------------------
 
+import os
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from jose import jwt
+from jose import jwt, JWTError
 from database import User, get_db
+from metrics import metrics
 
 router = APIRouter(prefix="/api", tags=["Auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-SECRET_KEY = "secret"
+# ---------- Config ----------
+SECRET_KEY = os.getenv("JWT_SECRET", "secret")
 ALGORITHM = "HS256"
-
+# bcrypt cost factor: each +1 doubles hashing time (12 ≈ 250ms on one core)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads dedicated to bcrypt, and how many hash jobs may be in flight/queued
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "4"))
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", "64"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# ---------- Password hashing off the event loop ----------
+# bcrypt releases the GIL, so a small dedicated pool gives real parallelism
+# without starving the default threadpool that serves sync routes.
+_hash_pool = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots: Optional[asyncio.Semaphore] = None
+_pending_hashes = 0
+metrics.register_queue("auth_hash", lambda: _pending_hashes)
+
+async def _run_hash_job(fn, *args):
+    """Runs a bcrypt call on the hash pool, bounding the number of queued jobs."""
+    global _hash_slots, _pending_hashes
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(AUTH_HASH_MAX_PENDING)
+    async with _hash_slots:
+        _pending_hashes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with metrics.stage("password_hash"):
+                return await loop.run_in_executor(_hash_pool, fn, *args)
+        finally:
+            _pending_hashes -= 1
+
+async def hash_password(password: str) -> str:
+    return await _run_hash_job(pwd_context.hash, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run_hash_job(pwd_context.verify, password, hashed)
+
+# ---------- Token verification cache ----------
+class TokenCache:
+    """Small thread-safe LRU of token -> decoded claims.
+
+    Entries are dropped once the token's `exp` has passed, so a cached token
+    never outlives its signature.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            claims = self._items.get(token)
+            if claims is None:
+                return None
+            if claims.get("exp", 0) <= time.time():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: Dict):
+        with self._lock:
+            self._items[token] = claims
+            self._items.move_to_end(token)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+token_cache = TokenCache()
+
+def decode_token(token: str) -> Dict:
+    """Verifies a JWT and returns its claims, using the LRU cache when possible."""
+    claims = token_cache.get(token)
+    metrics.record_cache("jwt_claims", claims is not None)
+    if claims is not None:
+        return claims
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(401, "Invalid or expired token")
+    if "sub" not in claims:
+        raise HTTPException(401, "Invalid token")
+    token_cache.put(token, claims)
+    return claims
+
+_bearer = HTTPBearer(auto_error=False)
+
+def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Dict:
+    """Dependency: claims of the authenticated user (`sub`, `email`, `name`). No DB access."""
+    if credentials is None:
+        raise HTTPException(401, "Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return decode_token(credentials.credentials)
+
+def get_optional_user_id(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> str:
+    """Dependency: user ID from the bearer token, or "default_user" for anonymous requests.
+
+    A stale (expired or invalid) token is treated as no token, so routes that
+    work anonymously keep working for a client whose session has lapsed.
+    """
+    if credentials is None:
+        return "default_user"
+    try:
+        return decode_token(credentials.credentials)["sub"]
+    except HTTPException:
+        metrics.counter("auth_stale_token_total").inc()
+        return "default_user"
+
+# ---------- Models ----------
 class SignupIn(BaseModel):
     name: str
     email: EmailStr
@@ -286,26 +404,38 @@ def create_access_token(data):
     data.update({"exp": expire})
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
+def _get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+def _save_user(db: Session, user: User):
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+# ---------- Routes ----------
 @router.post("/signup")
-def signup(data: SignupIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
+async def signup(data: SignupIn, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_get_user_by_email, db, data.email)
     if user:
         raise HTTPException(400, "Email already exists")
 
-    hashed = pwd_context.hash(data.password)
+    hashed = await hash_password(data.password)
 
     new_user = User(name=data.name, email=data.email, hashed_password=hashed)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await run_in_threadpool(_save_user, db, new_user)
 
     return {"ok": True, "message": "Signup successful"}
 
 @router.post("/login")
-def login(data: LoginIn, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == data.email).first()
-    if not user or not pwd_context.verify(data.password, user.hashed_password):
+async def login(data: LoginIn, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_get_user_by_email, db, data.email)
+    if not user or not await verify_password(data.password, user.hashed_password):
         raise HTTPException(401, "Invalid email or password")
 
-    token = create_access_token({"sub": str(user.id)})
+    token = create_access_token({"sub": str(user.id), "email": user.email, "name": user.name})
     return {"access_token": token, "token_type": "bearer"}
+
+@router.get("/me")
+def me(user: Dict = Depends(get_current_user)):
+    return {"id": user["sub"], "email": user.get("email"), "name": user.get("name")}
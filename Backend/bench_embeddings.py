@@ -0,0 +1,109 @@
+"""
+Benchmark embedding backends: throughput (sentences/sec), peak RSS and parity.
+
+Each backend runs in its own subprocess so RSS numbers are not polluted by
+the other backend's model.
+
+    python bench_embeddings.py                    # torch vs onnx on synthetic legal text
+    python bench_embeddings.py --file corpus.txt  # one sentence per line
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+def rss_mb():
+    """Current and peak resident set size in MB (Linux /proc)."""
+    current = peak = 0.0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                current = int(line.split()[1]) / 1024
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) / 1024
+    return current, peak
+
+def sample_sentences(n):
+    clauses = [
+        "The Receiving Party shall not disclose Confidential Information to any third party",
+        "Rent shall be payable in advance on or before the fifth day of each calendar month",
+        "The Service Provider warrants that the services will be performed in a professional manner",
+        "Either party may terminate this Agreement by giving thirty days written notice",
+        "Any dispute arising out of this Agreement shall be referred to arbitration in New Delhi",
+    ]
+    return [f"{clauses[i % len(clauses)]} (clause {i})." for i in range(n)]
+
+def run_worker(backend, sentences, batch_size):
+    """Runs inside the subprocess: loads one backend, encodes, prints JSON stats."""
+    from rag_service import EMBEDDING_MODEL_NAME
+    from embeddings import load_embedding_model
+
+    base_rss, _ = rss_mb()
+    start = time.perf_counter()
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, backend)
+    load_s = time.perf_counter() - start
+    model.encode(sentences[:batch_size], batch_size=batch_size)  # warm-up
+
+    start = time.perf_counter()
+    emb = model.encode(sentences, batch_size=batch_size, convert_to_numpy=True)
+    elapsed = time.perf_counter() - start
+    current, peak = rss_mb()
+
+    import numpy as np
+    np.save(f"/tmp/bench_emb_{backend}.npy", emb[:256].astype("float32"))
+    print(json.dumps({
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "sentences_per_s": round(len(sentences) / elapsed, 1),
+        "rss_mb": round(current - base_rss, 1),
+        "peak_rss_mb": round(peak, 1),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend benchmark")
+    parser.add_argument("--file", help="text file, one sentence per line")
+    parser.add_argument("-n", type=int, default=2000, help="synthetic sentences if no --file")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--backends", default="torch,onnx")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            sentences = [line.strip() for line in f if line.strip()]
+    else:
+        sentences = sample_sentences(args.n)
+
+    if args.worker:
+        run_worker(args.worker, sentences, args.batch_size)
+        return
+
+    results = []
+    for backend in args.backends.split(","):
+        cmd = [sys.executable, __file__, "--worker", backend, "--batch-size", str(args.batch_size)]
+        cmd += ["--file", args.file] if args.file else ["-n", str(args.n)]
+        proc = subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ {backend} failed:\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<8} {'sent/s':>10} {'load s':>8} {'model RSS MB':>13} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['sentences_per_s']:>10} {r['load_s']:>8} {r['rss_mb']:>13} {r['peak_rss_mb']:>12}")
+
+    names = [r["backend"] for r in results]
+    if "torch" in names and "onnx" in names:
+        import numpy as np
+        a = np.load("/tmp/bench_emb_torch.npy")
+        b = np.load("/tmp/bench_emb_onnx.npy")
+        a /= np.linalg.norm(a, axis=1, keepdims=True)
+        b /= np.linalg.norm(b, axis=1, keepdims=True)
+        cos = (a * b).sum(axis=1)
+        print(f"parity: cosine min={cos.min():.4f} mean={cos.mean():.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: latency added by cross-encoder re-ranking vs. retrieval quality gained.
+
+Input is a JSON-lines eval set, one query per line:
+
+    {"query": "...", "relevant": "text of the passage that answers it",
+     "passages": ["other passage", ...]}
+
+All passages from all lines form one corpus. For every query the script runs
+first-stage retrieval (bi-encoder + FAISS) and the re-ranked search, then
+reports recall@k, MRR@k and per-query latency for both.
+
+    python bench_rerank.py eval.jsonl --k 3 --candidates 20
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+
+def load_eval(path):
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rows.append(json.loads(line))
+    return rows
+
+def rank_of(results, relevant):
+    for i, r in enumerate(results, start=1):
+        if r["page_content"] == relevant:
+            return i
+    return None
+
+def summarize(name, ranks, latencies, k):
+    recall = sum(1 for r in ranks if r and r <= k) / len(ranks)
+    mrr = sum(1.0 / r for r in ranks if r and r <= k) / len(ranks)
+    lat = sorted(latencies)
+    p95 = lat[min(len(lat) - 1, int(0.95 * len(lat)))]
+    print(f"{name:<14} recall@{k}={recall:.3f}  MRR@{k}={mrr:.3f}  "
+          f"p50={statistics.median(lat) * 1000:.1f}ms  p95={p95 * 1000:.1f}ms")
+    return recall, mrr, statistics.median(lat)
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-ranking latency vs. quality benchmark")
+    parser.add_argument("eval_file")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=20, help="first-stage candidates to re-rank")
+    parser.add_argument("--budget-ms", type=float, default=10_000, help="re-rank budget (high = never fall back)")
+    args = parser.parse_args()
+
+    from rag_service import SimpleLegalRAG, get_embedding_model
+    from reranker import CrossEncoderReranker
+
+    rows = load_eval(args.eval_file)
+    corpus = list(dict.fromkeys(p for r in rows for p in [r["relevant"], *r.get("passages", [])]))
+    print(f"🔄 Indexing {len(corpus)} passages, {len(rows)} queries...")
+
+    rag = SimpleLegalRAG()
+    model = get_embedding_model()
+    rag.add_embeddings(corpus, np.asarray(model.encode(corpus, batch_size=64)), [{}] * len(corpus))
+
+    reranker = CrossEncoderReranker(budget_ms=args.budget_ms)
+    reranker.warm_up()
+
+    base_ranks, base_lat, rr_ranks, rr_lat = [], [], [], []
+    for row in rows:
+        start = time.perf_counter()
+        q_emb = model.encode([row["query"]])
+        candidates = rag.search_by_embedding(q_emb, max(args.k, args.candidates))
+        first_stage = time.perf_counter() - start
+        base_ranks.append(rank_of(candidates[:args.k], row["relevant"]))
+        base_lat.append(first_stage)
+
+        # Cold cache on purpose: measure real cross-encoder cost
+        reranker.cache = type(reranker.cache)()
+        start = time.perf_counter()
+        reranked = reranker.rerank(row["query"], candidates, args.k)
+        rr_lat.append(first_stage + time.perf_counter() - start)
+        rr_ranks.append(rank_of(reranked, row["relevant"]))
+
+    r0, m0, l0 = summarize("first-stage", base_ranks, base_lat, args.k)
+    r1, m1, l1 = summarize("re-ranked", rr_ranks, rr_lat, args.k)
+    print(f"Δ recall@{args.k}={r1 - r0:+.3f}  Δ MRR@{args.k}={m1 - m0:+.3f}  "
+          f"added p50 latency={(l1 - l0) * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
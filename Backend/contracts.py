@@ -0,0 +1,259 @@
+import csv
+import io
+import json
+import string
+import zipfile
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CONTRACT_TEMPLATES = {
+    "nda": {
+        "name": "Non-Disclosure Agreement",
+        "template": """
+THIS NON-DISCLOSURE AGREEMENT (the "Agreement") is made on {date}
+
+BETWEEN:
+{party1_name}, having address at {party1_address} ("Disclosing Party")
+
+AND:
+{party2_name}, having address at {party2_address} ("Receiving Party")
+
+1. CONFIDENTIAL INFORMATION
+The term "Confidential Information" shall mean {confidential_info}.
+
+2. OBLIGATIONS
+The Receiving Party shall:
+(a) Maintain the confidentiality of the Information
+(b) Use the same degree of care to protect Confidential Information  
+(c) Not disclose Confidential Information to any third party
+
+3. TERM
+This Agreement shall remain in effect for {duration} years.
+
+IN WITNESS WHEREOF, the parties have executed this Agreement.
+
+_________________________
+{party1_name}
+
+_________________________
+{party2_name}
+        """,
+        "fields": ["party1_name", "party1_address", "party2_name", "party2_address", 
+                  "confidential_info", "duration"]
+    },
+    
+    "rental_agreement": {
+        "name": "Residential Rental Agreement", 
+        "template": """
+RESIDENTIAL RENTAL AGREEMENT
+
+This Agreement made on {date} between:
+
+LANDLORD: {landlord_name}, address: {landlord_address}
+
+TENANT: {tenant_name}, address: {tenant_address}
+
+PROPERTY: {property_address}
+
+TERMS:
+1. Rent: ₹{rent_amount} per month, payable on {rent_due_date}
+2. Security Deposit: ₹{security_deposit}
+3. Lease Term: {lease_months} months from {start_date} to {end_date}
+4. Utilities: {utilities_responsibility}
+
+RULES:
+- No structural changes without permission
+- Proper maintenance required
+- {pet_policy}
+
+IN WITNESS WHEREOF, the parties execute this Agreement.
+
+_________________________
+{landlord_name}
+
+_________________________
+{tenant_name}
+        """,
+        "fields": ["landlord_name", "landlord_address", "tenant_name", "tenant_address",
+                  "property_address", "rent_amount", "security_deposit", "lease_months",
+                  "start_date", "end_date", "utilities_responsibility", "pet_policy"]
+    },
+    
+    "service_agreement": {
+        "name": "Service Agreement",
+        "template": """
+SERVICE AGREEMENT
+
+This Service Agreement is made on {date} between:
+
+SERVICE PROVIDER: {provider_name}, address: {provider_address}
+
+CLIENT: {client_name}, address: {client_address}
+
+SCOPE OF SERVICES:
+{services_description}
+
+TERMS:
+1. Service Fee: ₹{service_fee}
+2. Payment Terms: {payment_terms}
+3. Term: {contract_term}
+4. Termination: {termination_clause}
+
+WARRANTY:
+{service_warranty}
+
+IN WITNESS WHEREOF, the parties execute this Agreement.
+
+_________________________
+{provider_name}
+
+_________________________
+{client_name}
+        """,
+        "fields": ["provider_name", "provider_address", "client_name", "client_address",
+                  "services_description", "service_fee", "payment_terms", "contract_term",
+                  "termination_clause", "service_warranty"]
+    }
+}
+
+# Defaults applied when optional fields are not supplied
+TEMPLATE_DEFAULTS = {
+    "rental_agreement": {
+        "rent_due_date": "the 1st of each month",
+        "end_date": "as per lease term",
+        "utilities_responsibility": "Tenant shall pay all utilities",
+        "pet_policy": "No pets allowed without written permission",
+    },
+    "service_agreement": {
+        "payment_terms": "50% advance, 50% on completion",
+        "termination_clause": "Either party may terminate with 30 days written notice",
+        "service_warranty": "Services will be performed in a professional manner",
+    },
+}
+
+
+class ContractValidationError(ValueError):
+    """Raised when form data cannot be rendered into a contract."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+class CompiledTemplate:
+    """A contract template parsed once into literal text and placeholders.
+
+    Rendering is a single join over precomputed segments, so there is no
+    format-string parsing on the hot path.
+    """
+
+    def __init__(self, key: str, name: str, template: str, defaults: Optional[Dict] = None):
+        self.key = key
+        self.name = name
+        self.defaults = dict(defaults or {})
+        self._literals: List[str] = []
+        self._fields: List[str] = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"Unsupported placeholder {{{field}}} in template {key}")
+            self._literals.append(literal)
+            self._fields.append(field)
+        self.placeholders = frozenset(f for f in self._fields if f is not None)
+        self.required = frozenset(self.placeholders - set(self.defaults) - {"date"})
+
+    def render(self, form_data: Dict, today: Optional[str] = None) -> str:
+        values = {**self.defaults, **{k: v for k, v in form_data.items() if v not in (None, "")}}
+        if "date" not in values:
+            values["date"] = today or datetime.now().strftime("%B %d, %Y")
+        missing = [f for f in self.required if f not in values]
+        if missing:
+            raise ContractValidationError([f"Missing required field: '{f}'" for f in sorted(missing)])
+        parts = []
+        for literal, field in zip(self._literals, self._fields):
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+COMPILED_TEMPLATES: Dict[str, CompiledTemplate] = {
+    key: CompiledTemplate(key, spec["name"], spec["template"], TEMPLATE_DEFAULTS.get(key))
+    for key, spec in CONTRACT_TEMPLATES.items()
+}
+
+
+def get_template(template_type: str) -> CompiledTemplate:
+    try:
+        return COMPILED_TEMPLATES[template_type]
+    except KeyError:
+        raise ContractValidationError([f"Invalid template type: {template_type!r}"])
+
+
+# ---------- Bulk generation ----------
+def iter_batch_rows(stream, fmt: str) -> Iterator[Dict]:
+    """Yields form-data dicts from a binary CSV or JSON-lines stream without loading it all."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    if fmt == "csv":
+        for row in csv.DictReader(text):
+            yield {k.strip(): (v or "").strip() for k, v in row.items() if k}
+    elif fmt == "jsonl":
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield {"__error__": f"Invalid JSON: {e.msg}"}
+                continue
+            yield row if isinstance(row, dict) else {"__error__": "Row is not a JSON object"}
+    else:
+        raise ContractValidationError([f"Unsupported batch format: {fmt!r}"])
+
+
+def render_batch(rows: Iterable[Dict], default_template: Optional[str]) -> Iterator[Tuple[int, Dict]]:
+    """Renders each row; yields (row_number, result) with per-row errors instead of raising.
+
+    A row may carry its own `template_type`; nested `form_data` objects
+    (as sent to /api/generate-contract) are accepted too.
+    """
+    today = datetime.now().strftime("%B %d, %Y")
+    for n, row in enumerate(rows, start=1):
+        if "__error__" in row:
+            yield n, {"row": n, "ok": False, "errors": [row["__error__"]]}
+            continue
+        template_type = row.get("template_type") or default_template
+        form_data = row.get("form_data") if isinstance(row.get("form_data"), dict) else row
+        form_data = {k: v for k, v in form_data.items() if k != "template_type"}
+        try:
+            template = get_template(template_type)
+            contract = template.render(form_data, today=today)
+        except ContractValidationError as e:
+            yield n, {"row": n, "ok": False, "errors": e.errors}
+            continue
+        yield n, {"row": n, "ok": True, "template_type": template.key, "contract": contract}
+
+
+def stream_ndjson(results: Iterable[Tuple[int, Dict]]) -> Iterator[bytes]:
+    for _, result in results:
+        yield (json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def stream_zip(results: Iterable[Tuple[int, Dict]], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Builds a ZIP (one .txt per contract plus errors.json) in a spooled file and streams it."""
+    errors = []
+    with SpooledTemporaryFile(max_size=32 * 1024 * 1024) as buf:
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for n, result in results:
+                if result["ok"]:
+                    zf.writestr(f"{n:06d}_{result['template_type']}.txt", result["contract"])
+                else:
+                    errors.append({"row": n, "errors": result["errors"]})
+            zf.writestr("errors.json", json.dumps(errors, indent=2))
+        buf.seek(0)
+        while True:
+            chunk = buf.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
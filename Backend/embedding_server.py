@@ -0,0 +1,462 @@
+"""
+Out-of-process embedding and retrieval server ("sidecar") for multi-worker deployments.
+
+One sidecar process owns the embedding model, the re-ranker and every
+knowledge-base partition; uvicorn workers started with RAG_BACKEND=sidecar
+talk to it over a UNIX socket instead of loading their own copies. Memory no
+longer grows with the worker count, and a document ingested through one
+worker is immediately searchable from all of them.
+
+    python embedding_server.py                     # serve on EMBEDDING_SOCKET
+    RAG_BACKEND=sidecar uvicorn main:app --workers 4
+
+Wire format (all integers big-endian):
+
+    frame   = u32 payload length | u8 opcode (request) or status (response) | payload
+    payload = u32 JSON length | JSON object | [u32 rows | u32 cols | float32 LE matrix]
+
+Vectors always travel as raw float32, so an encode of 128 chunks is ~200 KB
+rather than ~1 MB of JSON. Concurrent encode requests from all workers are
+coalesced into one model call (up to SIDECAR_MAX_BATCH texts, waiting at most
+SIDECAR_BATCH_WAIT_MS for company).
+"""
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embeddings import EMBEDDING_BACKEND
+from metrics import metrics
+from rag_service import (DEFAULT_MATTER, EMBEDDING_MODEL_NAME, PartitionedLegalRAG, chunk_text,
+                         get_local_embedding_model)
+
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "/tmp/legalsetu-embeddings.sock")
+SIDECAR_TIMEOUT_S = float(os.getenv("SIDECAR_TIMEOUT_S", "300"))
+SIDECAR_MAX_BATCH = int(os.getenv("SIDECAR_MAX_BATCH", "256"))
+SIDECAR_BATCH_WAIT_MS = float(os.getenv("SIDECAR_BATCH_WAIT_MS", "2"))
+MAX_FRAME_BYTES = int(os.getenv("SIDECAR_MAX_FRAME_MB", "256")) * 1024 * 1024
+
+# Opcodes
+OP_ENCODE = 1
+OP_SEARCH = 2
+OP_ADD_DOCUMENT = 3
+OP_ADD_EMBEDDINGS = 4
+OP_SAVE = 5
+OP_LIST_MATTERS = 6
+OP_PARTITION_DIR = 7
+OP_STATUS = 8
+OP_RELOAD = 9
+OP_NAMES = {OP_ENCODE: "encode", OP_SEARCH: "search", OP_ADD_DOCUMENT: "add_document",
+            OP_ADD_EMBEDDINGS: "add_embeddings", OP_SAVE: "save", OP_LIST_MATTERS: "list_matters",
+            OP_PARTITION_DIR: "partition_dir", OP_STATUS: "status", OP_RELOAD: "reload"}
+# Safe to resend on a fresh connection if the old one turned out to be dead
+IDEMPOTENT_OPS = {OP_ENCODE, OP_SEARCH, OP_LIST_MATTERS, OP_PARTITION_DIR, OP_STATUS}
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_FRAME = struct.Struct(">IB")
+_U32 = struct.Struct(">I")
+_DIMS = struct.Struct(">II")
+
+
+class EmbeddingServerError(RuntimeError):
+    """The sidecar is unreachable or reported an error for a call."""
+
+
+# ---------- Protocol ----------
+def pack_message(obj: Optional[Dict] = None, array: Optional[np.ndarray] = None) -> bytes:
+    body = json.dumps(obj or {}, separators=(",", ":")).encode("utf-8")
+    parts = [_U32.pack(len(body)), body]
+    if array is not None:
+        matrix = np.ascontiguousarray(np.atleast_2d(array), dtype="<f4")
+        parts.append(_DIMS.pack(*matrix.shape))
+        parts.append(matrix.tobytes())
+    return b"".join(parts)
+
+
+def unpack_message(payload: bytes) -> Tuple[Dict, Optional[np.ndarray]]:
+    (body_len,) = _U32.unpack_from(payload, 0)
+    offset = _U32.size + body_len
+    obj = json.loads(payload[_U32.size:offset].decode("utf-8"))
+    if offset == len(payload):
+        return obj, None
+    rows, cols = _DIMS.unpack_from(payload, offset)
+    offset += _DIMS.size
+    array = np.frombuffer(payload, dtype="<f4", count=rows * cols, offset=offset).reshape(rows, cols)
+    return obj, array
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received)
+        if not count:
+            raise EOFError("connection closed")
+        received += count
+    return buf
+
+
+def send_frame(sock: socket.socket, code: int, payload: bytes):
+    sock.sendall(_FRAME.pack(len(payload), code) + payload)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[int, bytes]:
+    length, code = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    if length > MAX_FRAME_BYTES:
+        raise EmbeddingServerError(f"frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return code, _recv_exact(sock, length)
+
+
+# ---------- Server ----------
+class _EncodeRequest:
+    __slots__ = ("texts", "done", "result", "error")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class EncodeBatcher:
+    """Coalesces concurrent encode calls into one model call on a single thread."""
+
+    def __init__(self, max_batch: int = SIDECAR_MAX_BATCH, max_wait_ms: float = SIDECAR_BATCH_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[_EncodeRequest]" = queue.Queue()
+        metrics.register_queue("sidecar_encode", self._queue.qsize)
+        threading.Thread(target=self._run, name="encode-batcher", daemon=True).start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        request = _EncodeRequest(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._encode(batch)
+
+    def _encode(self, batch: List[_EncodeRequest]):
+        texts = [text for request in batch for text in request.texts]
+        try:
+            model = get_local_embedding_model()
+            with metrics.stage("embedding"):
+                embeddings = np.asarray(model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+            metrics.histogram("sidecar_batch_texts", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)).observe(len(texts))
+            offset = 0
+            for request in batch:
+                request.result = embeddings[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+        except BaseException as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+
+class EmbeddingService:
+    """Executes protocol operations against the process-wide model and partitions."""
+
+    def __init__(self, rag: Optional[PartitionedLegalRAG] = None, batcher: Optional[EncodeBatcher] = None):
+        from rag_service import legal_rag
+        self.rag = rag or (legal_rag if isinstance(legal_rag, PartitionedLegalRAG) else PartitionedLegalRAG())
+        self.batcher = batcher or EncodeBatcher()
+
+    def dispatch(self, op: int, args: Dict, array: Optional[np.ndarray]) -> Tuple[Dict, Optional[np.ndarray]]:
+        if op == OP_ENCODE:
+            texts = args["texts"]
+            if not texts:
+                return {}, np.zeros((0, self.dimension()), dtype=np.float32)
+            return {}, self.batcher.encode(texts)
+        if op == OP_SEARCH:
+            query_embedding = self.batcher.encode([args["query"]])
+            results = self.rag.search_similar(args["query"], args["tenant"], args.get("matters"),
+                                              args.get("k", 3), args.get("rerank"),
+                                              query_embedding=query_embedding)
+            return {"results": results}, None
+        if op == OP_ADD_DOCUMENT:
+            tenant, matter = args["tenant"], args.get("matter", DEFAULT_MATTER)
+            metadata = args.get("metadata") or {"source": "user_upload", "type": "legal_document"}
+            with self.rag.partition(tenant, matter) as rag:
+                with metrics.stage("chunking"):
+                    chunks = rag._chunk_text(args["text"])
+                if not chunks:
+                    return {"chunks": 0}, None
+                rag.add_embeddings(chunks, self.batcher.encode(chunks), [metadata] * len(chunks))
+            return {"chunks": len(chunks)}, None
+        if op == OP_ADD_EMBEDDINGS:
+            with self.rag.partition(args["tenant"], args.get("matter", DEFAULT_MATTER)) as rag:
+                rag.add_embeddings(args["chunks"], array, args["metadata"])
+            return {}, None
+        if op == OP_SAVE:
+            self.rag.save(args.get("tenant"), args.get("matter"))
+            return {}, None
+        if op == OP_LIST_MATTERS:
+            return {"matters": self.rag.list_matters(args["tenant"])}, None
+        if op == OP_PARTITION_DIR:
+            return {"path": os.path.abspath(self.rag.partition_dir(args["tenant"], args["matter"]))}, None
+        if op == OP_RELOAD:
+            with self.rag.partition(args["tenant"], args.get("matter", DEFAULT_MATTER)) as rag:
+                rag.reload()
+            return {}, None
+        if op == OP_STATUS:
+            return {"model": EMBEDDING_MODEL_NAME, "backend": EMBEDDING_BACKEND, "dimension": self.dimension(),
+                    "loaded_bytes": self.rag.loaded_bytes(), "pid": os.getpid()}, None
+        raise ValueError(f"unknown opcode {op}")
+
+    @staticmethod
+    def dimension() -> int:
+        return int(get_local_embedding_model().get_sentence_embedding_dimension())
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        service: EmbeddingService = self.server.service
+        while True:
+            try:
+                op, payload = recv_frame(self.request)
+            except (EOFError, ConnectionError, EmbeddingServerError):
+                return
+            start = time.perf_counter()
+            try:
+                args, array = unpack_message(payload)
+                response = pack_message(*service.dispatch(op, args, array))
+                status = STATUS_OK
+            except Exception as e:
+                response = f"{type(e).__name__}: {e}".encode("utf-8")
+                status = STATUS_ERROR
+                metrics.counter("sidecar_errors_total", {"op": OP_NAMES.get(op, str(op))}).inc()
+            try:
+                send_frame(self.request, status, response)
+            except (BrokenPipeError, ConnectionError):
+                return
+            metrics.histogram("sidecar_op_seconds", {"op": OP_NAMES.get(op, str(op))}).observe(
+                time.perf_counter() - start)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: str = EMBEDDING_SOCKET):
+    """Runs the sidecar until interrupted; loaded partitions are saved on exit."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    service = EmbeddingService()
+    server = _UnixServer(socket_path, _Handler)
+    server.service = service
+    os.chmod(socket_path, 0o660)
+    # Accept connections right away; calls block on the model until it has loaded
+    threading.Thread(target=get_local_embedding_model, name="model-load", daemon=True).start()
+    from reranker import reranker, RERANK_ENABLED
+    if RERANK_ENABLED:
+        threading.Thread(target=reranker.warm_up, name="reranker-load", daemon=True).start()
+    print(f"✅ Embedding server listening on {socket_path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.rag.save()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+# ---------- Client ----------
+class EmbeddingClient:
+    """Thread-safe client: one persistent connection per calling thread."""
+
+    def __init__(self, socket_path: str = EMBEDDING_SOCKET, timeout: float = SIDECAR_TIMEOUT_S):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError as e:
+                sock.close()
+                raise EmbeddingServerError(f"embedding server unavailable at {self.socket_path}: {e}")
+            self._local.sock = sock
+        return sock
+
+    def _reset(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def call(self, op: int, args: Optional[Dict] = None,
+             array: Optional[np.ndarray] = None) -> Tuple[Dict, Optional[np.ndarray]]:
+        payload = pack_message(args, array)
+        attempts = 2 if op in IDEMPOTENT_OPS else 1
+        for attempt in range(attempts):
+            try:
+                sock = self._connection()
+                send_frame(sock, op, payload)
+                status, response = recv_frame(sock)
+                break
+            except (OSError, EOFError) as e:
+                # Stale connection (e.g. the sidecar restarted): reconnect once
+                self._reset()
+                if attempt + 1 == attempts:
+                    raise EmbeddingServerError(f"embedding server call '{OP_NAMES[op]}' failed: {e}")
+        if status != STATUS_OK:
+            raise EmbeddingServerError(response.decode("utf-8", errors="replace"))
+        return unpack_message(response)
+
+
+class RemoteEncoder:
+    """SentenceTransformer-style `encode` served by the sidecar."""
+
+    def __init__(self, client: EmbeddingClient):
+        self.client = client
+        self._dimension: Optional[int] = None
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        _, embeddings = self.client.call(OP_ENCODE, {"texts": texts})
+        return embeddings[0] if single else embeddings
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.client.call(OP_STATUS)[0]["dimension"]
+        return self._dimension
+
+
+class SidecarPartition:
+    """Client-side stand-in for one SimpleLegalRAG partition (as used by IngestPipeline)."""
+
+    def __init__(self, client: EmbeddingClient, encoder: RemoteEncoder, tenant: str, matter: str):
+        self.client = client
+        self.embedding_model = encoder
+        self.tenant = tenant
+        self.matter = matter
+        self._persist_dir: Optional[str] = None
+
+    @property
+    def persist_dir(self) -> str:
+        # The sidecar runs on the same host, so its partition directory is ours too
+        if self._persist_dir is None:
+            self._persist_dir = self.client.call(
+                OP_PARTITION_DIR, {"tenant": self.tenant, "matter": self.matter})[0]["path"]
+        return self._persist_dir
+
+    def _ensure_loaded(self):
+        pass
+
+    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200):
+        return chunk_text(text, chunk_size, overlap)
+
+    def add_document(self, text: str, metadata: Dict = None) -> int:
+        return self.client.call(OP_ADD_DOCUMENT, {"text": text, "metadata": metadata, "tenant": self.tenant,
+                                                  "matter": self.matter})[0]["chunks"]
+
+    def add_embeddings(self, chunks: List[str], embeddings, metadata: List[Dict]):
+        self.client.call(OP_ADD_EMBEDDINGS, {"chunks": chunks, "metadata": metadata, "tenant": self.tenant,
+                                             "matter": self.matter}, embeddings)
+
+    def save(self):
+        self.client.call(OP_SAVE, {"tenant": self.tenant, "matter": self.matter})
+
+    def reload(self):
+        self.client.call(OP_RELOAD, {"tenant": self.tenant, "matter": self.matter})
+
+
+class SidecarLegalRAG:
+    """PartitionedLegalRAG interface backed by the sidecar."""
+
+    def __init__(self, client: Optional[EmbeddingClient] = None):
+        self.client = client or _client()
+        self.embedding_model = RemoteEncoder(self.client)
+
+    @contextmanager
+    def partition(self, tenant: str, matter: str = DEFAULT_MATTER):
+        yield SidecarPartition(self.client, self.embedding_model, tenant, matter)
+
+    def list_matters(self, tenant: str) -> List[str]:
+        return self.client.call(OP_LIST_MATTERS, {"tenant": tenant})[0]["matters"]
+
+    def loaded_bytes(self) -> int:
+        return self.client.call(OP_STATUS)[0]["loaded_bytes"]
+
+    def add_document(self, text: str, metadata: Dict = None, tenant: str = "default_user",
+                     matter: str = DEFAULT_MATTER) -> int:
+        if not metadata:
+            metadata = {"source": "user_upload", "type": "legal_document"}
+        with self.partition(tenant, matter) as rag:
+            return rag.add_document(text, metadata)
+
+    def save(self, tenant: Optional[str] = None, matter: Optional[str] = None):
+        self.client.call(OP_SAVE, {"tenant": tenant, "matter": matter})
+
+    def search_similar(self, query: str, tenant: str = "default_user",
+                       matters: Optional[List[str]] = None, k: int = 3,
+                       rerank: Optional[bool] = None):
+        args = {"query": query, "tenant": tenant, "matters": matters, "k": k, "rerank": rerank}
+        with metrics.stage("sidecar_search"):
+            return self.client.call(OP_SEARCH, args)[0]["results"]
+
+    def get_context_for_query(self, query: str, tenant: str = "default_user",
+                              matters: Optional[List[str]] = None) -> str:
+        similar_docs = self.search_similar(query, tenant, matters)
+        return "\n\n".join([doc['page_content'] for doc in similar_docs])
+
+
+_shared_client: Optional[EmbeddingClient] = None
+_shared_encoder: Optional[RemoteEncoder] = None
+
+
+def _client() -> EmbeddingClient:
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = EmbeddingClient()
+    return _shared_client
+
+
+def remote_encoder() -> RemoteEncoder:
+    """The process-wide encoder client used by rag_service.get_embedding_model()."""
+    global _shared_encoder
+    if _shared_encoder is None:
+        _shared_encoder = RemoteEncoder(_client())
+    return _shared_encoder
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_SOCKET)
@@ -0,0 +1,212 @@
+"""
+Selectable embedding backends with a SentenceTransformer-compatible `encode`.
+
+    EMBEDDING_BACKEND=torch   PyTorch SentenceTransformer (default)
+    EMBEDDING_BACKEND=onnx    ONNX Runtime, dynamically int8-quantized
+
+The ONNX backend exports the Hugging Face model once (cached under
+ONNX_CACHE_DIR), quantizes the weights to int8 and reproduces the
+SentenceTransformer pipeline for all-MiniLM-L6-v2: tokenize -> transformer ->
+mean pooling -> L2 normalize.
+
+    python embeddings.py export            # export + quantize + parity check
+
+This module is the single place EMBEDDING_BACKEND is read; numpy and the
+model libraries are imported inside the functions that need them, so
+importing it for the setting stays cheap.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import List, Union
+
+# "torch" (SentenceTransformer) or "onnx" (int8-quantized ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", "./onnx_models")
+# Threads per ONNX session; inference is intra-op parallel, so default to all cores
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", str(os.cpu_count() or 1)))
+MAX_SEQ_LENGTH = 256
+PARITY_THRESHOLD = 0.99
+
+
+def _hf_name(model_name: str) -> str:
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+@contextmanager
+def _export_lock(out_dir: str):
+    """Exclusive lock on a model's cache directory, shared across processes.
+
+    fcntl on POSIX, msvcrt on Windows; both are imported here so that
+    importing this module for EMBEDDING_BACKEND works on either platform.
+    """
+    with open(os.path.join(out_dir, ".export.lock"), "a+") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.5)  # held by another process
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_onnx(model_name: str, cache_dir: str = ONNX_CACHE_DIR) -> str:
+    """Exports the transformer to ONNX and writes an int8 dynamically-quantized copy.
+
+    Returns the path to the quantized model; no-op if it already exists.
+    Workers starting together export once under a file lock; files are built
+    in a temp directory and moved into place with the int8 model last, so a
+    reader never sees a partial model.
+    """
+    out_dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+
+    os.makedirs(out_dir, exist_ok=True)
+    with _export_lock(out_dir):
+        if os.path.exists(int8_path):
+            return int8_path  # exported by another process while we waited
+        tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=out_dir)
+        try:
+            _export_to(model_name, tmp_dir)
+            for name in sorted(os.listdir(tmp_dir), key=lambda n: n == "model.int8.onnx"):
+                os.replace(os.path.join(tmp_dir, name), os.path.join(out_dir, name))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    print(f"✅ Quantized model written to {int8_path}")
+    return int8_path
+
+
+def _export_to(model_name: str, out_dir: str):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print(f"🔄 Exporting {model_name} to ONNX...")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+    tokenizer = AutoTokenizer.from_pretrained(_hf_name(model_name))
+    model = AutoModel.from_pretrained(_hf_name(model_name)).eval()
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    dynamic = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic,
+                          "token_type_ids": dynamic, "last_hidden_state": dynamic},
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(out_dir)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+
+class OnnxSentenceEncoder:
+    """Drop-in replacement for SentenceTransformer.encode backed by ONNX Runtime."""
+
+    def __init__(self, model_name: str, cache_dir: str = ONNX_CACHE_DIR, threads: int = ONNX_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = export_onnx(model_name, cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(model_path))
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self.max_seq_length = MAX_SEQ_LENGTH
+
+    def get_sentence_embedding_dimension(self) -> int:
+        dim = self.session.get_outputs()[0].shape[-1]
+        return dim if isinstance(dim, int) else 384
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = True, **kwargs):
+        import numpy as np
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not sentences:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Sort by length so each batch pads to a similar size (as SentenceTransformer does)
+        order = np.argsort([-len(s) for s in sentences])
+        chunks = []
+        for start in range(0, len(sentences), batch_size):
+            batch = [sentences[i] for i in order[start:start + batch_size]]
+            enc = self.tokenizer(batch, padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            chunks.append(pooled.astype(np.float32))
+        out = np.empty((len(sentences), chunks[0].shape[1]), dtype=np.float32)
+        out[order] = np.concatenate(chunks)
+        return out[0] if single else out
+
+
+def load_embedding_model(model_name: str, backend: str = EMBEDDING_BACKEND):
+    """Returns an object with a SentenceTransformer-style `encode` for the chosen backend."""
+    if backend == "onnx":
+        return OnnxSentenceEncoder(model_name)
+    if backend != "torch":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend!r} (use 'torch' or 'onnx')")
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def cosine_parity(model_name: str, sentences: List[str]) -> float:
+    """Minimum cosine similarity between torch and ONNX embeddings of `sentences`."""
+    import numpy as np
+    torch_emb = load_embedding_model(model_name, "torch").encode(sentences, convert_to_numpy=True)
+    onnx_emb = load_embedding_model(model_name, "onnx").encode(sentences)
+    torch_emb = torch_emb / np.linalg.norm(torch_emb, axis=1, keepdims=True)
+    onnx_emb = onnx_emb / np.linalg.norm(onnx_emb, axis=1, keepdims=True)
+    return float((torch_emb * onnx_emb).sum(axis=1).min())
+
+
+PARITY_SENTENCES = [
+    "The Receiving Party shall maintain the confidentiality of the Information.",
+    "Rent of ₹25,000 per month is payable on the 1st of each month.",
+    "Either party may terminate this agreement with 30 days written notice.",
+    "The petitioner seeks relief under Article 226 of the Constitution of India.",
+    "This Agreement shall be governed by the laws of India.",
+]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        from rag_service import EMBEDDING_MODEL_NAME
+        export_onnx(EMBEDDING_MODEL_NAME)
+        parity = cosine_parity(EMBEDDING_MODEL_NAME, PARITY_SENTENCES)
+        status = "✅" if parity >= PARITY_THRESHOLD else "❌"
+        print(f"{status} min cosine similarity torch vs onnx-int8: {parity:.4f} (threshold {PARITY_THRESHOLD})")
+        sys.exit(0 if parity >= PARITY_THRESHOLD else 1)
+    print(__doc__)
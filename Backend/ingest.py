@@ -0,0 +1,313 @@
+"""
+Bulk ingestion pipeline for the RAG knowledge base.
+
+Files stream through a staged pipeline connected by bounded queues:
+
+    discover -> hash/skip -> extract (worker processes) -> chunk -> batched embed -> index
+
+Bounded queues give backpressure: a slow embedding stage stalls extraction
+instead of piling parsed documents up in memory. Progress is checkpointed to
+a manifest of content hashes, so an interrupted run can simply be restarted.
+
+    python ingest.py /data/case-law --workers 8 --batch-size 256
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import metrics
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+MANIFEST_NAME = "manifest.jsonl"
+_DONE = object()
+
+
+# ---------- Extraction (runs in worker processes) ----------
+def extract_text_from_path(path: str) -> str:
+    """Extracts text from a PDF, DOCX or TXT file on disk."""
+    lower = path.lower()
+    if lower.endswith(".pdf"):
+        import PyPDF2
+        with open(path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            return "".join(page.extract_text() or "" for page in reader.pages)
+    if lower.endswith(".docx"):
+        import docx
+        doc = docx.Document(path)
+        return "\n".join(p.text for p in doc.paragraphs)
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="ignore")
+
+
+def _extract_job(path: str) -> Tuple[Optional[str], Optional[str], float]:
+    start = time.perf_counter()
+    try:
+        return extract_text_from_path(path), None, time.perf_counter() - start
+    except Exception as e:
+        return None, str(e), time.perf_counter() - start
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def discover_files(paths: Iterable[str]) -> Iterable[str]:
+    """Yields supported files from a mix of file and directory paths."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif path.lower().endswith(SUPPORTED_EXTENSIONS):
+            yield path
+
+
+# ---------- Manifest ----------
+class IngestManifest:
+    """Append-only JSON-lines record of content hashes already in the index."""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.hashes = set()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.hashes.add(json.loads(line)["hash"])
+
+    def __contains__(self, content_hash: str) -> bool:
+        return content_hash in self.hashes
+
+    def append(self, entries: List[Dict]):
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+                self.hashes.add(entry["hash"])
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# ---------- Pipeline ----------
+class IngestPipeline:
+    """Pipelined bulk ingest into a SimpleLegalRAG instance."""
+
+    def __init__(self, rag, workers: int = None, batch_size: int = 128,
+                 queue_size: int = 64, checkpoint_every: int = 500, log_interval: float = 5.0):
+        self.rag = rag
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint_every = checkpoint_every
+        self.log_interval = log_interval
+        self.manifest = IngestManifest(rag.persist_dir or ".")
+        self.stats = {"seen": 0, "skipped": 0, "ingested": 0, "failed": 0, "chunks": 0, "errors": []}
+        self._texts: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._chunks: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._failure: Optional[BaseException] = None
+        metrics.register_queue("ingest_extracted", self._texts.qsize)
+        metrics.register_queue("ingest_chunked", self._chunks.qsize)
+
+    def run(self, files: Iterable[Tuple[str, str]]) -> Dict:
+        """Ingests (source_name, path) pairs; returns stats including docs/sec."""
+        start = time.perf_counter()
+        self.rag._ensure_loaded()
+        stages = [
+            threading.Thread(target=self._guard(self._extract_stage), args=(files,), name="ingest-extract"),
+            threading.Thread(target=self._guard(self._chunk_stage), name="ingest-chunk"),
+            threading.Thread(target=self._guard(self._embed_stage), name="ingest-embed"),
+        ]
+        for t in stages:
+            t.start()
+        for t in stages:
+            t.join()
+        if self._failure is not None:
+            # Vectors indexed since the last checkpoint have no manifest entries;
+            # drop them so a later save (or eviction) cannot persist them
+            self.rag.reload()
+            raise self._failure
+
+        elapsed = time.perf_counter() - start
+        self.stats["seconds"] = round(elapsed, 2)
+        self.stats["docs_per_sec"] = round(self.stats["ingested"] / elapsed, 2) if elapsed else 0.0
+        self.stats["errors"] = self.stats["errors"][:50]
+        return self.stats
+
+    def _guard(self, fn):
+        def wrapper(*args):
+            try:
+                fn(*args)
+            except BaseException as e:
+                self._failure = e
+        return wrapper
+
+    def _put(self, q: "queue.Queue", item):
+        """Blocking put that gives up once another stage has failed."""
+        while self._failure is None:
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: "queue.Queue"):
+        while self._failure is None:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _extract_stage(self, files: Iterable[Tuple[str, str]]):
+        """Hashes files, skips ones in the manifest, extracts text in worker processes.
+
+        At most `queue_size` extractions are in flight; results are handed on
+        in submission order.
+        """
+        in_flight = deque()
+        seen_hashes = set()
+
+        def hand_off():
+            source, content_hash, future = in_flight.popleft()
+            text, error, seconds = future.result()
+            metrics.observe_stage("extraction", seconds)
+            if error or not (text or "").strip():
+                self.stats["failed"] += 1
+                self.stats["errors"].append({"source": source, "error": error or "No text extracted"})
+            else:
+                self._put(self._texts, (source, content_hash, text))
+
+        # Spawned, not forked: the pipeline runs inside a threaded server process
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            for source, path in files:
+                if self._failure is not None:
+                    break
+                self.stats["seen"] += 1
+                content_hash = hash_file(path)
+                if content_hash in self.manifest or content_hash in seen_hashes:
+                    self.stats["skipped"] += 1
+                    continue
+                seen_hashes.add(content_hash)
+                in_flight.append((source, content_hash, pool.submit(_extract_job, path)))
+                if len(in_flight) >= self.queue_size:
+                    hand_off()
+            while in_flight and self._failure is None:
+                hand_off()
+        self._put(self._texts, _DONE)
+
+    def _chunk_stage(self):
+        while True:
+            item = self._get(self._texts)
+            if item is _DONE:
+                break
+            source, content_hash, text = item
+            with metrics.stage("chunking"):
+                chunks = self.rag._chunk_text(text)
+            self._put(self._chunks, (source, content_hash, chunks))
+        self._put(self._chunks, _DONE)
+
+    def _embed_stage(self):
+        """Accumulates chunks across documents into fixed-size embedding batches."""
+        model = self.rag.embedding_model
+        batch_texts: List[str] = []
+        batch_meta: List[Dict] = []
+        # Documents whose chunks are all in batches that have been (or are about to be) indexed
+        completed: List[Dict] = []
+        pending_manifest: List[Dict] = []
+        last_log = time.perf_counter()
+        run_start = last_log
+
+        def flush():
+            if batch_texts:
+                with metrics.stage("embedding"):
+                    embeddings = model.encode(batch_texts, batch_size=self.batch_size, convert_to_numpy=True)
+                self.rag.add_embeddings(list(batch_texts), embeddings, list(batch_meta))
+                self.stats["chunks"] += len(batch_texts)
+                batch_texts.clear()
+                batch_meta.clear()
+            pending_manifest.extend(completed)
+            self.stats["ingested"] += len(completed)
+            completed.clear()
+
+        def checkpoint():
+            flush()
+            if pending_manifest:
+                # Index first, then manifest: a crash in between re-ingests, never loses
+                self.rag.save()
+                self.manifest.append(pending_manifest)
+                pending_manifest.clear()
+
+        while True:
+            item = self._get(self._chunks)
+            if item is _DONE:
+                break
+            source, content_hash, chunks = item
+            meta = {"source": source, "type": "legal_document", "hash": content_hash}
+            batch_texts.extend(chunks)
+            batch_meta.extend([meta] * len(chunks))
+            completed.append({"hash": content_hash, "source": source, "chunks": len(chunks), "ts": time.time()})
+            if len(batch_texts) >= self.batch_size:
+                flush()
+            if len(pending_manifest) >= self.checkpoint_every:
+                checkpoint()
+            if time.perf_counter() - last_log > self.log_interval:
+                last_log = time.perf_counter()
+                rate = self.stats["ingested"] / (last_log - run_start)
+                print(f"🔄 {self.stats['ingested']} docs ingested, {self.stats['skipped']} skipped "
+                      f"({rate:.1f} docs/s)")
+        if self._failure is None:
+            checkpoint()
+
+
+def ingest_paths(paths: Iterable[str], rag=None, tenant: str = "default_user",
+                 matter: str = "general", **kwargs) -> Dict:
+    """Ingest files/directories into `rag`, or into a tenant/matter partition of legal_rag."""
+    files = ((os.path.basename(p), p) for p in discover_files(paths))
+    if rag is not None:
+        return IngestPipeline(rag, **kwargs).run(files)
+    from rag_service import legal_rag
+    with legal_rag.partition(tenant, matter) as partition:
+        return IngestPipeline(partition, **kwargs).run(files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest documents into the LegalSetu knowledge base")
+    parser.add_argument("paths", nargs="+", help="files or directories (pdf/docx/txt)")
+    parser.add_argument("--tenant", default="default_user", help="tenant (user ID) that owns the documents")
+    parser.add_argument("--matter", default="general", help="matter partition within the tenant")
+    parser.add_argument("--workers", type=int, default=None, help="extraction worker processes")
+    parser.add_argument("--batch-size", type=int, default=128, help="chunks per embedding batch")
+    parser.add_argument("--queue-size", type=int, default=64, help="bound on each inter-stage queue")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="documents between index saves")
+    args = parser.parse_args()
+
+    stats = ingest_paths(
+        args.paths, tenant=args.tenant, matter=args.matter, workers=args.workers, batch_size=args.batch_size,
+        queue_size=args.queue_size, checkpoint_every=args.checkpoint_every,
+    )
+    print(f"✅ Ingested {stats['ingested']} docs ({stats['chunks']} chunks), "
+          f"skipped {stats['skipped']}, failed {stats['failed']} "
+          f"in {stats['seconds']}s — {stats['docs_per_sec']} docs/s")
+    for err in stats["errors"]:
+        print(f"   ❌ {err['source']}: {err['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Background job subsystem for long-running document operations.
+
+Submitting a job returns immediately with a job ID; a local thread pool runs
+the registered handler and reports progress. Job state lives in SQLite so it
+survives restarts and is shared by every uvicorn worker:
+
+- each active job is owned by one process under a lease (JOB_LEASE_S) that
+  the owner's heartbeat keeps renewing, and a worker only runs a job after
+  claiming it with a conditional UPDATE, so no job runs twice;
+- jobs whose lease has expired (their process died) are taken over and
+  queued again by whichever worker notices first; their inputs stay on disk
+  under JOBS_DIR until the job finishes;
+- cancellation is a flag in the database, so it reaches the job wherever it
+  runs.
+"""
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from metrics import metrics
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "legal_chatbot.db")
+JOBS_DIR = os.getenv("JOBS_DIR", "./job_data")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Queued + running jobs allowed per user at once
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "3"))
+# Seconds an owner may go without renewing before others take its jobs over
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "60"))
+
+ACTIVE_STATES = ("queued", "running")
+FINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+class JobLimitExceeded(Exception):
+    """Raised when a user already has JOB_MAX_PER_USER active jobs."""
+
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation checks."""
+
+    def __init__(self, manager: "JobManager", job_id: str, input_dir: str):
+        self.manager = manager
+        self.job_id = job_id
+        self.input_dir = input_dir
+
+    @property
+    def cancelled(self) -> bool:
+        return self.manager._cancel_requested(self.job_id)
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, fraction: float, message: str = ""):
+        """Records progress (0..1); also a cancellation point."""
+        self.check_cancelled()
+        self.manager._update(self.job_id, progress=round(min(max(fraction, 0.0), 1.0), 4), message=message)
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobManager:
+    def __init__(self, db_path: str = JOBS_DB_PATH, jobs_dir: str = JOBS_DIR,
+                 workers: int = JOB_WORKERS, max_per_user: int = JOB_MAX_PER_USER,
+                 lease_s: float = JOB_LEASE_S):
+        self.db_path = db_path
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.lease_s = lease_s
+        # Identifies this process (and manager) as the owner of the jobs it runs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[JobContext, Dict], Dict]] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._heartbeat_stop = threading.Event()
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+        self._init_db()
+        metrics.register_queue("jobs", lambda: self._queued)
+
+    # ---------- Storage ----------
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                kind TEXT,
+                status TEXT,
+                progress REAL,
+                message TEXT,
+                payload TEXT,
+                result TEXT,
+                error TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (user_id, status)")
+        # Columns added for multi-process ownership; older databases are migrated in place
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name, decl in (("owner", "TEXT"), ("lease_expires", "REAL"),
+                           ("cancel_requested", "INTEGER NOT NULL DEFAULT 0")):
+            if name not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+                except sqlite3.OperationalError:
+                    pass  # added concurrently by another worker
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_lease ON jobs (status, lease_expires)")
+        conn.commit()
+        conn.close()
+
+    def _update(self, job_id: str, where: str = "", where_args: tuple = (), **fields) -> bool:
+        """Updates a job row; `where` adds conditions. Returns whether a row changed."""
+        fields["updated_at"] = _now()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        conn = self._conn()
+        cur = conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?{where}", (*fields.values(), job_id, *where_args))
+        conn.commit()
+        conn.close()
+        return cur.rowcount == 1
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        conn = self._conn()
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        return bool(row and row["cancel_requested"])
+
+    @staticmethod
+    def _row_to_dict(row, include_result: bool = False) -> Dict:
+        job = {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": row["progress"],
+            "message": row["message"],
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def get(self, job_id: str, user_id: Optional[str] = None, include_result: bool = False) -> Optional[Dict]:
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        if row is None or (user_id is not None and row["user_id"] != user_id):
+            return None
+        return self._row_to_dict(row, include_result)
+
+    def list(self, user_id: str, limit: int = 50) -> List[Dict]:
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (user_id, limit)
+        ).fetchall()
+        conn.close()
+        return [self._row_to_dict(r) for r in rows]
+
+    # ---------- Lifecycle ----------
+    def register(self, kind: str, handler: Callable[[JobContext, Dict], Dict]):
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Starts the worker pool and lease heartbeat, and takes over orphaned jobs."""
+        if self._pool is not None:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._heartbeat_stop.clear()
+        self.recover_expired()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def shutdown(self):
+        self._heartbeat_stop.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _heartbeat(self):
+        """Renews the leases of this process's jobs and adopts jobs whose owner died."""
+        while not self._heartbeat_stop.wait(self.lease_s / 3):
+            try:
+                conn = self._conn()
+                conn.execute(
+                    "UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                    (time.time() + self.lease_s, self.owner),
+                )
+                conn.commit()
+                conn.close()
+                self.recover_expired()
+            except sqlite3.Error as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    def recover_expired(self) -> int:
+        """Takes over active jobs whose lease has expired and queues them here."""
+        now = time.time()
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT id, kind FROM jobs WHERE status IN ('queued', 'running') "
+            "AND (lease_expires IS NULL OR lease_expires < ?) ORDER BY created_at", (now,)
+        ).fetchall()
+        conn.close()
+        recovered = 0
+        for row in rows:
+            # Conditional on the lease still being expired: exactly one process wins
+            expired = " AND status IN ('queued', 'running') AND (lease_expires IS NULL OR lease_expires < ?)"
+            if row["kind"] not in self._handlers:
+                self._update(row["id"], expired, (now,), status="failed",
+                             error=f"Unknown job kind: {row['kind']}")
+                continue
+            if self._update(row["id"], expired, (now,), status="queued", owner=self.owner,
+                            lease_expires=now + self.lease_s, message="Re-queued after restart"):
+                self._enqueue(row["id"])
+                recovered += 1
+        return recovered
+
+    def input_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def submit(self, kind: str, user_id: str, payload: Dict, prepare: Optional[Callable[[str], None]] = None) -> str:
+        """Creates a job and queues it. `prepare(input_dir)` may store input files first."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        conn = self._conn()
+        try:
+            # BEGIN IMMEDIATE takes the database write lock before counting, so the
+            # per-user limit holds across processes sharing the jobs database
+            conn.execute("BEGIN IMMEDIATE")
+            active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running')", (user_id,)
+            ).fetchone()[0]
+            if active >= self.max_per_user:
+                raise JobLimitExceeded(f"You already have {active} active jobs (limit {self.max_per_user})")
+            now = _now()
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, kind, status, progress, message, payload, created_at, updated_at, "
+                "owner, lease_expires) VALUES (?, ?, ?, 'queued', 0, 'Queued', ?, ?, ?, ?, ?)",
+                (job_id, user_id, kind, json.dumps(payload), now, now, self.owner, time.time() + self.lease_s),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        try:
+            if prepare is not None:
+                input_dir = self.input_dir(job_id)
+                os.makedirs(input_dir, exist_ok=True)
+                prepare(input_dir)
+        except Exception as e:
+            self._update(job_id, status="failed", error=f"Could not store job input: {e}")
+            raise
+        metrics.record_event(f"jobs_{kind}")
+        self._enqueue(job_id)
+        return job_id
+
+    def cancel(self, job_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        job = self.get(job_id, user_id)
+        if job is None:
+            return None
+        if job["status"] in ACTIVE_STATES:
+            # Not started yet: cancel outright (the claim in _run then fails)
+            if self._update(job_id, " AND status = 'queued'", status="cancelled",
+                            message="Cancelled", cancel_requested=1):
+                shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
+            else:
+                # Running, possibly in another process: its next progress() check stops it
+                self._update(job_id, " AND status = 'running'", message="Cancellation requested",
+                             cancel_requested=1)
+        return self.get(job_id, user_id)
+
+    def _enqueue(self, job_id: str):
+        with self._queued_lock:
+            self._queued += 1
+        self._pool.submit(self._run, job_id)
+
+    def _run(self, job_id: str):
+        with self._queued_lock:
+            self._queued -= 1
+        # Claim: only the owner, and only while the job is still queued and not cancelled
+        if not self._update(job_id, " AND status = 'queued' AND owner = ? AND cancel_requested = 0",
+                            (self.owner,), status="running", message="Running",
+                            lease_expires=time.time() + self.lease_s):
+            conn = self._conn()
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.close()
+            if row is not None and row["status"] == "cancelled":
+                shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
+            return
+        conn = self._conn()
+        row = conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        conn.close()
+        ctx = JobContext(self, job_id, self.input_dir(job_id))
+        try:
+            with metrics.stage(f"job_{row['kind']}"):
+                result = self._handlers[row["kind"]](ctx, json.loads(row["payload"] or "{}"))
+            self._finish(job_id, status="succeeded", progress=1.0, message="Done",
+                         result=json.dumps(result))
+        except JobCancelled:
+            self._finish(job_id, status="cancelled", message="Cancelled")
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            self._finish(job_id, status="failed", message="Failed", error=str(error))
+
+    def _finish(self, job_id: str, **fields):
+        # A job taken over after our lease lapsed belongs to its new owner now
+        if self._update(job_id, " AND owner = ?", (self.owner,), lease_expires=None, **fields):
+            shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
+
+
+# Global job manager; handlers are registered by main.py
+job_manager = JobManager()
@@ -3,26 +3,41 @@ import os
 import logging
 import json
 from io import BytesIO
-from typing import List, Optional
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from typing import Dict, List, Optional
+import time
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
+# Load .env before the local imports below: auth, rag_service, jobs, uploads and
+# the other modules read their settings (JWT_SECRET, MAX_UPLOAD_MB, ...) at import time
+load_dotenv()
 import uvicorn
-from auth import router as auth_router
+from auth import router as auth_router, get_optional_user_id
 import sqlite3
-import uuid
-
-import google.generativeai as genai
-from pdfminer.high_level import extract_text
-import docx
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import faiss
-from rag_service import legal_rag
-import PyPDF2
-import io
+
+import asyncio
+import threading
+import shutil
+import tempfile
+from collections import OrderedDict
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from embeddings import EMBEDDING_BACKEND
+from rag_service import legal_rag, DEFAULT_MATTER, EMBEDDING_MODEL_NAME, get_embedding_model, warm_up_until_ready, warmup_status
+from metrics import metrics
+from tracing import SERVER_TIMING_ENABLED, start_trace, current_trace, end_trace, maybe_start_profiler, finish_profiler
+from scheduler import llm_scheduler, LLMOverloaded
+from jobs import job_manager, JobContext, JobLimitExceeded, ACTIVE_STATES
+from ingest import IngestManifest, IngestPipeline, SUPPORTED_EXTENSIONS, hash_file
+from uploads import receive_upload, require_file
+from artifacts import artifact_store
+from contracts import COMPILED_TEMPLATES, ContractValidationError, get_template, iter_batch_rows, render_batch, stream_ndjson, stream_zip
+
+# NOTE: pdfminer, python-docx, PyPDF2, faiss and sentence_transformers are
+# imported inside the functions that use them. Keeping them out of module
+# scope lets workers (and --reload) start serving in well under a second.
 
 # CORS setup moved below after FastAPI app initialization to avoid referencing `app` before it's defined.
 
@@ -50,115 +65,6 @@ def init_db():
 init_db()
 
 
-CONTRACT_TEMPLATES = {
-    "nda": {
-        "name": "Non-Disclosure Agreement",
-        "template": """
-THIS NON-DISCLOSURE AGREEMENT (the "Agreement") is made on {date}
-
-BETWEEN:
-{party1_name}, having address at {party1_address} ("Disclosing Party")
-
-AND:
-{party2_name}, having address at {party2_address} ("Receiving Party")
-
-1. CONFIDENTIAL INFORMATION
-The term "Confidential Information" shall mean {confidential_info}.
-
-2. OBLIGATIONS
-The Receiving Party shall:
-(a) Maintain the confidentiality of the Information
-(b) Use the same degree of care to protect Confidential Information  
-(c) Not disclose Confidential Information to any third party
-
-3. TERM
-This Agreement shall remain in effect for {duration} years.
-
-IN WITNESS WHEREOF, the parties have executed this Agreement.
-
-_________________________
-{party1_name}
-
-_________________________
-{party2_name}
-        """,
-        "fields": ["party1_name", "party1_address", "party2_name", "party2_address", 
-                  "confidential_info", "duration"]
-    },
-    
-    "rental_agreement": {
-        "name": "Residential Rental Agreement", 
-        "template": """
-RESIDENTIAL RENTAL AGREEMENT
-
-This Agreement made on {date} between:
-
-LANDLORD: {landlord_name}, address: {landlord_address}
-
-TENANT: {tenant_name}, address: {tenant_address}
-
-PROPERTY: {property_address}
-
-TERMS:
-1. Rent: ₹{rent_amount} per month, payable on {rent_due_date}
-2. Security Deposit: ₹{security_deposit}
-3. Lease Term: {lease_months} months from {start_date} to {end_date}
-4. Utilities: {utilities_responsibility}
-
-RULES:
-- No structural changes without permission
-- Proper maintenance required
-- {pet_policy}
-
-IN WITNESS WHEREOF, the parties execute this Agreement.
-
-_________________________
-{landlord_name}
-
-_________________________
-{tenant_name}
-        """,
-        "fields": ["landlord_name", "landlord_address", "tenant_name", "tenant_address",
-                  "property_address", "rent_amount", "security_deposit", "lease_months",
-                  "start_date", "end_date", "utilities_responsibility", "pet_policy"]
-    },
-    
-    "service_agreement": {
-        "name": "Service Agreement",
-        "template": """
-SERVICE AGREEMENT
-
-This Service Agreement is made on {date} between:
-
-SERVICE PROVIDER: {provider_name}, address: {provider_address}
-
-CLIENT: {client_name}, address: {client_address}
-
-SCOPE OF SERVICES:
-{services_description}
-
-TERMS:
-1. Service Fee: ₹{service_fee}
-2. Payment Terms: {payment_terms}
-3. Term: {contract_term}
-4. Termination: {termination_clause}
-
-WARRANTY:
-{service_warranty}
-
-IN WITNESS WHEREOF, the parties execute this Agreement.
-
-_________________________
-{provider_name}
-
-_________________________
-{client_name}
-        """,
-        "fields": ["provider_name", "provider_address", "client_name", "client_address",
-                  "services_description", "service_fee", "payment_terms", "contract_term",
-                  "termination_clause", "service_warranty"]
-    }
-}
 # Pydantic Models
 class ChatMessage(BaseModel):
     sender: str
@@ -172,15 +78,25 @@ class ChatSession(BaseModel):
     created_at: str
     updated_at: str
 
-# ---------- Load .env ----------
-load_dotenv()
+# ---------- Settings (.env is loaded at the top of this file) ----------
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-flash")
 
 if not GEMINI_API_KEY:
     raise RuntimeError("❌ GEMINI_API_KEY not found — add it to your .env file")
 
-genai.configure(api_key=GEMINI_API_KEY)
+# google.generativeai (and its grpc/protobuf stack) takes ~0.4s to import, so it
+# is loaded on the first Gemini call rather than by every worker at startup.
+_genai = None
+
+def get_genai():
+    """Returns the configured google.generativeai module, importing it on first use."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
 
 # ------------------------------------- Logging ----------------------------------------------
 logging.basicConfig(level=logging.INFO)
@@ -196,35 +112,199 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Profile-Id", "Retry-After"],
 )
 
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    """Fast 503 when the LLM scheduler sheds a request."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Records per-route latency and status, and reports the request's stage spans.
+
+    Stage timings go out as a Server-Timing header. If the request asked to be
+    profiled (or was sampled), the collapsed-stack profile is written under
+    PROFILE_DIR and its id returned in X-Profile-Id.
+    """
+    start = time.perf_counter()
+    status = 500
+    trace_token = start_trace()
+    profiler = maybe_start_profiler(request.headers, f"{request.method}-{request.url.path}")
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        if SERVER_TIMING_ENABLED:
+            response.headers["Server-Timing"] = current_trace().server_timing(time.perf_counter() - start)
+        if profiler is not None:
+            response.headers["X-Profile-Id"] = profiler.profile_id
+        return response
+    finally:
+        end_trace(trace_token)
+        if profiler is not None:
+            profile_path = await run_in_threadpool(finish_profiler, profiler)
+            logger.info(f"Profile of {request.method} {request.url.path} written to {profile_path} "
+                        f"({profiler.samples} samples)")
+        # Use the route template (e.g. /api/summarize) so label cardinality stays bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        metrics.observe_request(request.method, path, status, time.perf_counter() - start)
+
 # ---------- Utility functions ----------
-def extract_text_from_pdf_bytes(content: bytes) -> str:
-    """Extracts text safely from PDF file bytes."""
+def _as_stream(source):
+    """Bytes -> BytesIO; a file handle (e.g. a spooled upload) is rewound and used as is."""
+    if isinstance(source, (bytes, bytearray)):
+        return BytesIO(source)
+    source.seek(0)
+    return source
+
+def extract_text_from_pdf_bytes(source) -> str:
+    """Extracts text safely from PDF bytes or a binary file handle."""
+    from pdfminer.high_level import extract_text
     try:
-        text = extract_text(BytesIO(content))
+        with metrics.stage("extraction"):
+            text = extract_text(_as_stream(source))
         if not text.strip():
             raise ValueError("No text found in PDF.")
         return text
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting PDF text: {e}")
 
-def build_faiss_index(text: str):
-    """Break text into chunks and build FAISS index for semantic search."""
-    embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-    chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
-    embeddings = embed_model.encode(chunks, convert_to_numpy=True)
+def build_faiss_index(embeddings):
+    """Builds an in-memory FAISS index over one document's chunk embeddings."""
+    import faiss
     index = faiss.IndexFlatL2(embeddings.shape[1])
     index.add(embeddings.astype("float32"))
-    return embed_model, index, chunks
+    return index
+
+def extract_document_text(filename: str, source) -> str:
+    """Extracts text from PDF (pdfminer), DOCX or TXT bytes/file handle for the analysis endpoints."""
+    filename = filename.lower()
+    if filename.endswith(".pdf"):
+        return extract_text_from_pdf_bytes(source)
+    if filename.endswith(".docx"):
+        import docx
+        with metrics.stage("extraction"):
+            doc = docx.Document(_as_stream(source))
+            return "\n".join([p.text for p in doc.paragraphs])
+    if filename.endswith(".txt"):
+        return _as_stream(source).read().decode("utf-8", errors="ignore")
+    raise HTTPException(400, "Unsupported file type. Please use PDF, DOCX, or TXT.")
+
+def extract_knowledge_text(filename: str, source) -> str:
+    """Extracts text for the knowledge base (PyPDF2 for PDFs; anything else is read as text)."""
+    filename = filename.lower()
+    with metrics.stage("extraction"):
+        if filename.endswith('.pdf'):
+            import PyPDF2
+            pdf_reader = PyPDF2.PdfReader(_as_stream(source))
+            return "".join(page.extract_text() or "" for page in pdf_reader.pages)
+        elif filename.endswith('.docx'):
+            import docx
+            doc = docx.Document(_as_stream(source))
+            return "\n".join([para.text for para in doc.paragraphs])
+        # For txt files
+        return _as_stream(source).read().decode('utf-8', errors='ignore')
+
+# ---------- Document artifacts ----------
+# Everything derived from an upload is stored by content hash (see artifacts.py),
+# so classify -> summarize -> ask-doc-query on one document parses and embeds it once.
+# Vectors from different backends or models are not interchangeable, so both are part of the key
+EMBEDDINGS_ARTIFACT = f"embeddings-{EMBEDDING_BACKEND}-" + EMBEDDING_MODEL_NAME.replace("/", "__")
+
+def document_text(upload) -> str:
+    return artifact_store.get_or_compute(
+        upload.sha256, "text", lambda: extract_document_text(upload.filename, upload.open()))
+
+def document_chunks(upload) -> List[str]:
+    """1000-char chunks of the document; only the boundaries are stored."""
+    text = document_text(upload)
+
+    def chunk_bounds():
+        with metrics.stage("chunking"):
+            return [[i, min(i + 1000, len(text))] for i in range(0, len(text), 1000)]
+
+    bounds = artifact_store.get_or_compute(upload.sha256, "chunks", chunk_bounds)
+    return [text[start:end] for start, end in bounds]
+
+def document_embeddings(upload, chunks: List[str]):
+    def embed():
+        with metrics.stage("embedding"):
+            return get_embedding_model().encode(chunks, convert_to_numpy=True).astype("float32")
+
+    return artifact_store.get_or_compute(upload.sha256, EMBEDDINGS_ARTIFACT, embed)
+
+def _summary_part_prompts(text: str) -> List[str]:
+    with metrics.stage("chunking"):
+        chunks = [text[i:i+6000] for i in range(0, len(text), 6000)]
+    return [f"Summarize the following legal document part {i+1}/{len(chunks)}:\n\n{chunk}"
+            for i, chunk in enumerate(chunks)]
+
+def _summary_final_prompt(summaries: List[str]) -> str:
+    return (
+        "Combine these partial summaries into a final structured legal summary "
+        "with sections like: 'Overview', 'Key Clauses', 'Risks', and 'Recommendations'.\n\n"
+        + "\n\n---\n\n".join(summaries)
+    )
+
+def summarize_text(text: str, on_progress=None, user_id: str = "default_user", shed: bool = True) -> str:
+    """Map-reduce summary: summarize 6000-char parts, then combine into a structured summary.
+
+    Blocking; used by background jobs. on_progress(fraction, message) is called
+    after each Gemini call. Calls are scheduled as batch work; shed=False waits
+    for capacity instead of failing.
+    """
+    prompts = _summary_part_prompts(text)
+    summaries = []
+    for i, prompt in enumerate(prompts):
+        summaries.append(generate_with_gemini(prompt, "batch", user_id, shed=shed))
+        if on_progress:
+            on_progress((i + 1) / (len(prompts) + 1), f"Summarized part {i+1}/{len(prompts)}")
+    return generate_with_gemini(_summary_final_prompt(summaries), "batch", user_id, shed=shed)
+
+async def summarize_text_async(text: str, user_id: str = "default_user") -> str:
+    """summarize_text for request handlers: each call queues on the event loop."""
+    summaries = []
+    for prompt in _summary_part_prompts(text):
+        summaries.append(await generate_with_gemini_async(prompt, "batch", user_id))
+    return await generate_with_gemini_async(_summary_final_prompt(summaries), "batch", user_id)
 
 # ---------- Gemini Helper Function ----------
-def call_gemini_direct(prompt: str, model=GEMINI_MODEL):
+def generate_with_gemini(prompt: str, priority: str = "interactive", user_id: str = "default_user",
+                         shed: bool = True, model=GEMINI_MODEL) -> str:
+    """One Gemini generate_content call, admitted through the LLM scheduler.
+
+    Blocking - call it from a worker thread, never directly on the event loop.
+    Raises LLMOverloaded when the call is shed.
+    """
+    model_instance = get_genai().GenerativeModel(model)
+    with llm_scheduler.slot(priority, user_id, shed):
+        with metrics.stage("gemini_call"):
+            return model_instance.generate_content(prompt).text
+
+def _generate_content(prompt: str, model) -> str:
+    with metrics.stage("gemini_call"):
+        return get_genai().GenerativeModel(model).generate_content(prompt).text
+
+async def generate_with_gemini_async(prompt: str, priority: str = "interactive", user_id: str = "default_user",
+                                     shed: bool = True, model=GEMINI_MODEL) -> str:
+    """generate_with_gemini for request handlers.
+
+    Queueing happens on the event loop; a worker thread is only taken once the
+    call is admitted. Raises LLMOverloaded when the call is shed.
+    """
+    async with llm_scheduler.slot_async(priority, user_id, shed):
+        return await run_in_threadpool(_generate_content, prompt, model)
+
+def call_gemini_direct(prompt: str, model=GEMINI_MODEL, priority: str = "interactive",
+                       user_id: str = "default_user"):
     """Direct call to Gemini without chat memory"""
     try:
-        model_instance = genai.GenerativeModel(model)
-        response = model_instance.generate_content(prompt)
-        return response.text
+        return generate_with_gemini(prompt, priority, user_id, model=model)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Gemini direct call error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -238,133 +318,217 @@ class AskQueryResponse(BaseModel):
     sources: Optional[List[str]] = None
 
 # ---------- Gemini Chat with Memory Support ----------
-chat_sessions = {}
-
-def call_gemini_chat_with_memory(user_id: str, user_message: str, model=GEMINI_MODEL):
+# One Gemini ChatSession per user, least-recently-used first; idle sessions expire
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "1000"))
+CHAT_SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", "3600"))
+
+class _UserChat:
+    """A user's chat session and the lock that serializes turns on it (ChatSession is not thread-safe)."""
+    __slots__ = ("chat", "lock", "last_used")
+
+    def __init__(self):
+        self.chat = None
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+chat_sessions: "OrderedDict[str, _UserChat]" = OrderedDict()
+metrics.gauge("gemini_chat_sessions", fn=lambda: len(chat_sessions))
+
+def _user_chat(user_id: str) -> _UserChat:
+    """Returns the user's entry, creating it; expires idle entries and enforces CHAT_SESSION_MAX.
+
+    Runs on the event loop without awaiting, so check-and-create cannot interleave.
+    """
+    now = time.monotonic()
+    entry = chat_sessions.get(user_id)
+    metrics.record_cache("gemini_chat_session", entry is not None and entry.chat is not None)
+    if entry is None:
+        entry = chat_sessions[user_id] = _UserChat()
+    entry.last_used = now
+    chat_sessions.move_to_end(user_id)
+    # Oldest first: stop at the first entry that is neither expired nor over the bound
+    for other_id in list(chat_sessions):
+        other = chat_sessions[other_id]
+        if other is entry or (now - other.last_used <= CHAT_SESSION_TTL_S
+                              and len(chat_sessions) <= CHAT_SESSION_MAX):
+            break
+        if not other.lock.locked():  # never drop a session mid-turn
+            del chat_sessions[other_id]
+    return entry
+
+def _start_chat(model):
+    return get_genai().GenerativeModel(model).start_chat(history=[])
+
+def _send_chat_message(chat, user_message: str):
+    with metrics.stage("gemini_call"):
+        return chat.send_message(user_message)
+
+async def call_gemini_chat_with_memory(user_id: str, user_message: str, model=GEMINI_MODEL):
     """Maintain chat context for a user using Gemini chat sessions."""
     try:
-        if user_id not in chat_sessions:
-            model_instance = genai.GenerativeModel(model)
-            chat_sessions[user_id] = model_instance.start_chat(history=[])
-        chat = chat_sessions[user_id]
-        response = chat.send_message(user_message)
+        entry = _user_chat(user_id)
+        # Turns of one user run one at a time, in order, on their shared history
+        async with entry.lock:
+            if entry.chat is None:
+                # The first session may import the Gemini SDK; keep that off the event loop
+                entry.chat = await run_in_threadpool(_start_chat, model)
+            async with llm_scheduler.slot_async("interactive", user_id):
+                response = await run_in_threadpool(_send_chat_message, entry.chat, user_message)
         return response.text
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Gemini chat memory error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------- Routes ----------
+# ---------- Startup warm-up ----------
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+@app.on_event("startup")
+def start_background_warmup():
+    """Loads the embedding model in the background so the first RAG request is not slow."""
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up_until_ready, name="warm-up", daemon=True).start()
+
 @app.get("/")
 def home():
     return {"message": "✅ Gemini Legal Assistant Backend is running"}
 
+@app.get("/healthz")
+def liveness():
+    """Liveness: the process is up and the event loop is serving."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readiness():
+    """Readiness: heavy subsystems are loaded (or warm-up is disabled and they load on demand)."""
+    status = warmup_status()
+    ready = status["status"] == "ready" or not WARMUP_ON_STARTUP
+    if not ready:
+        return JSONResponse(status_code=503, content={"ready": False, **status})
+    return {"ready": True, **status}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/metrics")
+def dashboard_metrics(window: str = "24h"):
+    """JSON metrics for the analytics dashboard. window: 1m, 5m, 1h or 24h."""
+    return metrics.snapshot(window)
+
 # STEP 2: main.py mein routes ke section mein yeh add karo
 @app.post("/api/generate-contract")
 async def generate_contract(contract_data: dict):
     try:
         template_type = contract_data.get("template_type")
         form_data = contract_data.get("form_data", {})
-        
-        if template_type not in CONTRACT_TEMPLATES:
-            raise HTTPException(status_code=400, detail="Invalid template type")
-        
-        template = CONTRACT_TEMPLATES[template_type]["template"]
-        
-        # Add current date if not provided
-        if "date" not in form_data:
-            form_data["date"] = datetime.now().strftime("%B %d, %Y")
-            
-        # Add default values for optional fields
-        if template_type == "rental_agreement":
-            form_data.setdefault("rent_due_date", "the 1st of each month")
-            form_data.setdefault("end_date", "as per lease term")
-            form_data.setdefault("utilities_responsibility", "Tenant shall pay all utilities")
-            form_data.setdefault("pet_policy", "No pets allowed without written permission")
-            
-        elif template_type == "service_agreement":
-            form_data.setdefault("payment_terms", "50% advance, 50% on completion")
-            form_data.setdefault("termination_clause", "Either party may terminate with 30 days written notice")
-            form_data.setdefault("service_warranty", "Services will be performed in a professional manner")
-        
-        # Replace placeholders with actual data
-        generated_contract = template.format(**form_data)
-        
+
+        # Templates are compiled once at import; render() fills date and optional defaults
+        template = get_template(template_type)
+        generated_contract = template.render(form_data)
+        metrics.record_event("contracts_generated")
+
         return {
             "success": True,
             "contract": generated_contract,
-            "template_name": CONTRACT_TEMPLATES[template_type]["name"]
+            "template_name": template.name
         }
-        
-    except KeyError as e:
-        raise HTTPException(status_code=400, detail=f"Missing required field: {str(e)}")
+
+    except ContractValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating contract: {str(e)}")
 
+@app.post("/api/generate-contracts/bulk")
+async def generate_contracts_bulk(request: Request):
+    """Render many contracts from a CSV or JSON-lines batch.
+
+    Multipart fields: `file`, optional `template_type` and `output`. Each row
+    is one contract's form data (a `template_type` column overrides the form
+    field). Output is streamed as NDJSON (one result per row, with per-row
+    validation errors) or as a ZIP with errors.json.
+    """
+    form = await receive_upload(request)
+    upload = require_file(form)
+    template_type = form.fields.get("template_type") or None
+    output = form.fields.get("output") or "ndjson"
+    filename = upload.filename.lower()
+    fmt = "csv" if filename.endswith(".csv") else "jsonl" if filename.endswith((".jsonl", ".ndjson", ".json")) else None
+    try:
+        if fmt is None:
+            raise HTTPException(400, "Unsupported batch file. Please use .csv or .jsonl")
+        if output not in ("ndjson", "zip"):
+            raise HTTPException(400, "output must be 'ndjson' or 'zip'")
+        if template_type is not None and template_type not in COMPILED_TEMPLATES:
+            raise HTTPException(400, "Invalid template type")
+    except HTTPException:
+        form.close()
+        raise
+
+    def counted(results):
+        for n, result in results:
+            if result["ok"]:
+                metrics.record_event("contracts_generated")
+            yield n, result
+
+    results = counted(render_batch(iter_batch_rows(upload.open(), fmt), template_type))
+    # The spooled upload is read while the response streams; close it afterwards
+    if output == "zip":
+        return StreamingResponse(
+            stream_zip(results),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="contracts.zip"'},
+            background=BackgroundTask(form.close),
+        )
+    return StreamingResponse(stream_ndjson(results), media_type="application/x-ndjson",
+                             background=BackgroundTask(form.close))
+
 @app.post("/api/ask-query", response_model=AskQueryResponse)
-async def ask_query(req: AskQueryRequest):
+async def ask_query(req: AskQueryRequest, user_id: str = Depends(get_optional_user_id)):
     """Maintains memory across chats per user (context-aware)."""
     try:
-        user_id = "default_user"
         logger.info(f"ask-query received from {user_id}")
-        answer = call_gemini_chat_with_memory(user_id, req.query)
+        metrics.record_event("queries")
+        answer = await call_gemini_chat_with_memory(user_id, req.query)
         return {"answer": answer, "sources": []}
+    except (HTTPException, LLMOverloaded):
+        raise
     except Exception as e:
         logger.error(f"Error in /api/ask-query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/summarize")
-async def summarize(file: UploadFile = File(...)):
-    """Uploads a PDF/DOCX/TXT and returns a structured summary."""
+async def summarize(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Uploads a PDF/DOCX/TXT (multipart field `file`) and returns a structured summary."""
+    form = await receive_upload(request)
     try:
-        content = await file.read()
-        filename = file.filename.lower()
-
-        if filename.endswith(".pdf"):
-            text = extract_text_from_pdf_bytes(content)
-        elif filename.endswith(".docx"):
-            doc = docx.Document(BytesIO(content))
-            text = "\n".join([p.text for p in doc.paragraphs])
-        elif filename.endswith(".txt"):
-            text = content.decode("utf-8", errors="ignore")
-        else:
-            raise HTTPException(400, "Unsupported file type. Please use PDF, DOCX, or TXT.")
+        upload = require_file(form)
+        metrics.record_event("documents_analyzed")
 
-        chunks = [text[i:i+6000] for i in range(0, len(text), 6000)]
-        summaries = []
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        for i, chunk in enumerate(chunks):
-            prompt = f"Summarize the following legal document part {i+1}/{len(chunks)}:\n\n{chunk}"
-            response = model.generate_content(prompt)
-            summaries.append(response.text)
-
-        final_prompt = (
-            "Combine these partial summaries into a final structured legal summary "
-            "with sections like: 'Overview', 'Key Clauses', 'Risks', and 'Recommendations'.\n\n"
-            + "\n\n---\n\n".join(summaries)
-        )
-        final_summary = model.generate_content(final_prompt).text
-        return {"summary": final_summary}
+        async def compute_summary():
+            text = await run_in_threadpool(document_text, upload)
+            return await summarize_text_async(text, user_id)
+
+        summary = await artifact_store.get_or_compute_async(upload.sha256, "summary", compute_summary)
+        return {"summary": summary}
+    except (HTTPException, LLMOverloaded):
+        raise
     except Exception as e:
         logger.error(f"Error in /api/summarize: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/api/classify")
-async def classify_text(file: UploadFile = File(...)):
-    """Classify the uploaded legal document as Agreement, Notice, Petition, Judgment, or Other."""
-    try:
-        content = await file.read()
-        filename = file.filename.lower()
-        if filename.endswith(".pdf"):
-            text = extract_text_from_pdf_bytes(content)
-        elif filename.endswith(".docx"):
-            doc = docx.Document(BytesIO(content))
-            text = "\n".join([p.text for p in doc.paragraphs])
-        elif filename.endswith(".txt"):
-            text = content.decode("utf-8", errors="ignore")
-        else:
-            raise HTTPException(400, "Unsupported file type.")
-
-        prompt = f"""
+    finally:
+        form.close()
+
+async def classify_document(upload, user_id: str) -> Dict:
+    """Gemini classification of an upload, stored as an artifact once it parses."""
+    cached = await run_in_threadpool(artifact_store.get, upload.sha256, "classification")
+    if cached is not None:
+        return cached
+    text = await run_in_threadpool(document_text, upload)
+    prompt = f"""
 Classify the following document into one of:
 - Agreement
 - Petition
@@ -377,39 +541,60 @@ Respond only with pure JSON like: {{"category": "...", "confidence": 0.XX"}}
 Document Text:
 {text[:6000]}
 """
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(prompt)
-        import re
-        clean = re.sub(r"```json|```", "", response.text.strip()).strip()
-        try:
-            parsed = json.loads(clean)
-        except Exception:
-            parsed = {"category": "Other", "confidence": 0.0}
-        return parsed
+    response_text = await generate_with_gemini_async(prompt, "batch", user_id)
+    import re
+    clean = re.sub(r"```json|```", "", response_text.strip()).strip()
+    try:
+        parsed = json.loads(clean)
+    except Exception:
+        # Not stored, so the next request asks Gemini again
+        return {"category": "Other", "confidence": 0.0}
+    await run_in_threadpool(artifact_store.put, upload.sha256, "classification", parsed)
+    return parsed
+
+@app.post("/api/classify")
+async def classify_text(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Classify the uploaded legal document as Agreement, Notice, Petition, Judgment, or Other."""
+    form = await receive_upload(request)
+    try:
+        upload = require_file(form)
+        metrics.record_event("documents_analyzed")
+        return await classify_document(upload, user_id)
+    except (HTTPException, LLMOverloaded):
+        raise
     except Exception as e:
         logger.error(f"Error in /api/classify: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        form.close()
 
 @app.post("/api/ask-doc-query")
-async def ask_doc_query(file: UploadFile = File(...), query: str = Form(...)):
-    """Ask a question based on document context using RAG (semantic search + Gemini)."""
+async def ask_doc_query(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Ask a question based on document context using RAG (semantic search + Gemini).
+
+    Multipart fields: `file` and `query`.
+    """
+    form = await receive_upload(request)
     try:
-        content = await file.read()
-        filename = file.filename.lower()
-        if filename.endswith(".pdf"):
-            text = extract_text_from_pdf_bytes(content)
-        elif filename.endswith(".docx"):
-            doc = docx.Document(BytesIO(content))
-            text = "\n".join([p.text for p in doc.paragraphs])
-        elif filename.endswith(".txt"):
-            text = content.decode("utf-8", errors="ignore")
-        else:
-            raise HTTPException(400, "Unsupported file type (use pdf/docx/txt).")
-
-        embed_model, index, chunks = build_faiss_index(text)
-        q_emb = embed_model.encode([query], convert_to_numpy=True).astype("float32")
-        D, I = index.search(q_emb, 3)
-        top_context = "\n\n".join([chunks[i] for i in I[0]])
+        upload = require_file(form)
+        query = form.fields.get("query", "").strip()
+        if not query:
+            raise HTTPException(422, "Missing form field 'query'")
+        metrics.record_event("documents_analyzed")
+        metrics.record_event("queries")
+
+        def retrieve() -> str:
+            chunks = document_chunks(upload)
+            if not chunks:
+                return ""
+            index = build_faiss_index(document_embeddings(upload, chunks))
+            with metrics.stage("embedding"):
+                q_emb = get_embedding_model().encode([query], convert_to_numpy=True).astype("float32")
+            with metrics.stage("faiss_search"):
+                D, I = index.search(q_emb, 3)
+            return "\n\n".join([chunks[i] for i in I[0] if 0 <= i < len(chunks)])
+
+        top_context = await run_in_threadpool(retrieve)
 
         prompt = f"""
 You are LegalSetu, an AI legal assistant. 
@@ -421,61 +606,266 @@ Context:
 
 Question: {query}
 """
-        g_model = genai.GenerativeModel(GEMINI_MODEL)
-        response = g_model.generate_content(prompt)
-        return {"answer": response.text}
+        answer = await generate_with_gemini_async(prompt, "interactive", user_id)
+        return {"answer": answer}
+    except (HTTPException, LLMOverloaded):
+        raise
     except Exception as e:
         logger.error(f"Error in /api/ask-doc-query (RAG): {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        form.close()
 
 # 🚨 RAG ENDPOINTS - YAHAN SE ADD KARO 🚨
 
-@app.post("/api/add-to-knowledge")
-async def add_to_knowledge(file: UploadFile = File(...)):
-    """Add uploaded file to RAG knowledge base"""
-    try:
-        content = await file.read()
-        filename = file.filename.lower()
-        
+def ingest_knowledge_document(tenant: str, matter: str, filename: str, content_hash: str, source,
+                              on_progress=None):
+    """Adds one document to a knowledge partition unless its hash is already in the manifest.
+
+    Shared by /api/add-to-knowledge and the add_to_knowledge job. Returns
+    (chunks added, duplicate).
+    """
+    with legal_rag.partition(tenant, matter) as partition:
+        manifest = IngestManifest(partition.persist_dir)
+        metrics.record_cache("upload_hash", content_hash in manifest)
+        if content_hash in manifest:
+            return 0, True
+        if on_progress:
+            on_progress(0.1, "Extracting text")
         # Extract text based on file type
-        if filename.endswith('.pdf'):
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() or ""
-        elif filename.endswith('.docx'):
-            doc_file = io.BytesIO(content)
-            doc = docx.Document(doc_file)
-            text = "\n".join([para.text for para in doc.paragraphs])
-        else:
-            # For txt files
-            text = content.decode('utf-8', errors='ignore')
-        
-        # Add to RAG system
-        doc_count = legal_rag.add_document(
-            text, 
-            metadata={"source": file.filename, "type": "legal_document"}
+        text = extract_knowledge_text(filename, source)
+        if on_progress:
+            on_progress(0.3, "Embedding and indexing")
+        doc_count = partition.add_document(
+            text,
+            metadata={"source": filename, "type": "legal_document", "hash": content_hash},
         )
+        partition.save()
+        manifest.append([{"hash": content_hash, "source": filename, "chunks": doc_count, "ts": time.time()}])
+        return doc_count, False
+
+@app.post("/api/add-to-knowledge")
+async def add_to_knowledge(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Add uploaded file to the user's knowledge base, in the given matter partition.
+
+    Multipart fields: `file` and optional `matter`. The content hash is known
+    once the upload is received, so a file already in the partition's ingest
+    manifest is skipped without being parsed or embedded.
+    """
+    form = await receive_upload(request)
+    try:
+        upload = require_file(form)
+        matter = form.fields.get("matter") or DEFAULT_MATTER
+
+        doc_count, duplicate = await run_in_threadpool(
+            ingest_knowledge_document, user_id, matter, upload.filename, upload.sha256, upload.open())
+        if duplicate:
+            return {
+                "message": "Document is already in the knowledge base",
+                "chunks_added": 0,
+                "duplicate": True,
+            }
+        metrics.record_event("uploads")
         
         return {
             "message": f"Successfully added {doc_count} document chunks to knowledge base",
             "chunks_added": doc_count
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in /api/add-to-knowledge: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        form.close()
+
+@app.post("/api/add-to-knowledge/bulk")
+async def add_to_knowledge_bulk(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Add many files to the knowledge base through the pipelined ingester.
+
+    Multipart fields: one or more `files` and optional `matter`. Uploads are
+    copied to a temp directory, then extracted in parallel, embedded in
+    batches and indexed. Files already in the manifest (same content hash)
+    are skipped.
+    """
+    form = await receive_upload(request)
+    tmp_dir = tempfile.mkdtemp(prefix="ingest-")
+    try:
+        files = form.files.get("files")
+        if not files:
+            raise HTTPException(422, "Missing file field 'files'")
+        matter = form.fields.get("matter") or DEFAULT_MATTER
+        sources = []
+        for i, upload in enumerate(files):
+            name = upload.filename or f"upload-{i}.txt"
+            if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                raise HTTPException(400, f"Unsupported file type: {name}")
+            path = os.path.join(tmp_dir, f"{i:05d}_{name}")
+            with open(path, "wb") as out:
+                await run_in_threadpool(shutil.copyfileobj, upload.open(), out, 1 << 20)
+            upload.close()
+            sources.append((name, path))
+
+        def run_ingest():
+            with legal_rag.partition(user_id, matter) as partition:
+                return IngestPipeline(partition).run(sources)
+
+        stats = await run_in_threadpool(run_ingest)
+        metrics.record_event("uploads", stats["ingested"])
+        return {
+            "message": f"Ingested {stats['ingested']} of {len(sources)} files",
+            **stats,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in /api/add-to-knowledge/bulk: {e}")
+        raise HTTPException(status_code=500, detail=f"Bulk ingest error: {str(e)}")
+    finally:
+        form.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# ---------- Background jobs ----------
+def _open_job_input(ctx: JobContext, payload: Dict):
+    return open(os.path.join(ctx.input_dir, "input"), "rb")
+
+def summarize_job(ctx: JobContext, payload: Dict) -> Dict:
+    ctx.progress(0.0, "Extracting text")
+    with _open_job_input(ctx, payload) as f:
+        text = extract_document_text(payload["filename"], f)
+    metrics.record_event("documents_analyzed")
+    ctx.progress(0.05, "Summarizing")
+    # Background work waits for LLM capacity rather than being shed
+    return {"summary": summarize_text(text, on_progress=ctx.progress, user_id=payload.get("user_id", "default_user"),
+                                      shed=False)}
+
+def add_to_knowledge_job(ctx: JobContext, payload: Dict) -> Dict:
+    ctx.progress(0.0, "Checking knowledge base")
+    content_hash = payload.get("sha256") or hash_file(os.path.join(ctx.input_dir, "input"))
+    with _open_job_input(ctx, payload) as f:
+        doc_count, duplicate = ingest_knowledge_document(
+            payload["tenant"], payload.get("matter", DEFAULT_MATTER), payload["filename"], content_hash, f,
+            on_progress=ctx.progress)
+    if duplicate:
+        return {"chunks_added": 0, "duplicate": True}
+    metrics.record_event("uploads")
+    return {"chunks_added": doc_count}
+
+job_manager.register("summarize", summarize_job)
+job_manager.register("add_to_knowledge", add_to_knowledge_job)
+
+@app.on_event("startup")
+def start_job_workers():
+    job_manager.start()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_manager.shutdown()
+
+async def _submit_file_job(kind: str, upload, user_id: str, extra: Optional[Dict] = None) -> Dict:
+    def store_input(input_dir: str):
+        with open(os.path.join(input_dir, "input"), "wb") as out:
+            shutil.copyfileobj(upload.open(), out, 1 << 20)
+    try:
+        job_id = await run_in_threadpool(
+            job_manager.submit, kind, user_id,
+            {"filename": upload.filename or "upload.txt", "user_id": user_id, "sha256": upload.sha256,
+             **(extra or {})},
+            store_input
+        )
+    except JobLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}
+
+@app.post("/api/jobs/summarize", status_code=202)
+async def submit_summarize_job(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Queue a summary of a large document; poll /api/jobs/{job_id} for progress."""
+    form = await receive_upload(request)
+    try:
+        return await _submit_file_job("summarize", require_file(form), user_id)
+    finally:
+        form.close()
+
+@app.post("/api/jobs/add-to-knowledge", status_code=202)
+async def submit_add_to_knowledge_job(request: Request, user_id: str = Depends(get_optional_user_id)):
+    """Queue adding a document to the user's knowledge base (fields: `file`, optional `matter`)."""
+    form = await receive_upload(request)
+    try:
+        matter = form.fields.get("matter") or DEFAULT_MATTER
+        return await _submit_file_job("add_to_knowledge", require_file(form), user_id,
+                                      {"tenant": user_id, "matter": matter})
+    finally:
+        form.close()
+
+@app.get("/api/jobs")
+def list_jobs(user_id: str = Depends(get_optional_user_id)):
+    return {"jobs": job_manager.list(user_id)}
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str, user_id: str = Depends(get_optional_user_id)):
+    job = job_manager.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+def get_job_result(job_id: str, user_id: str = Depends(get_optional_user_id)):
+    job = job_manager.get(job_id, user_id, include_result=True)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    if job["status"] in ACTIVE_STATES:
+        raise HTTPException(409, f"Job is still {job['status']}")
+    if job["status"] != "succeeded":
+        raise HTTPException(410, job["error"] or f"Job {job['status']}")
+    return job["result"]
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, user_id: str = Depends(get_optional_user_id)):
+    """Server-Sent Events feed of job progress; ends when the job finishes."""
+    if await run_in_threadpool(job_manager.get, job_id, user_id) is None:
+        raise HTTPException(404, "Job not found")
+
+    async def event_stream():
+        last = None
+        while True:
+            job = await run_in_threadpool(job_manager.get, job_id, user_id)
+            snapshot = (job["status"], job["progress"], job["message"])
+            if snapshot != last:
+                last = snapshot
+                yield f"event: progress\ndata: {json.dumps(job)}\n\n"
+            if job["status"] not in ACTIVE_STATES:
+                yield f"event: end\ndata: {json.dumps(job)}\n\n"
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, user_id: str = Depends(get_optional_user_id)):
+    job = job_manager.cancel(job_id, user_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
 
 @app.post("/api/rag-chat")
-async def rag_chat(request: dict):
-    """Enhanced chat with RAG context"""
+async def rag_chat(request: dict, user_id: str = Depends(get_optional_user_id)):
+    """Enhanced chat with RAG context from the user's own knowledge base.
+
+    Optional "matters" (list) or "matter" restricts the search to those partitions;
+    "rerank": true/false overrides RERANK_ENABLED for this request.
+    """
     try:
         query = request.get("query", )
-        user_id = "default_user"  # Same as your existing chat
+        matters = request.get("matters") or ([request["matter"]] if request.get("matter") else None)
+        metrics.record_event("queries")
         
-        # Get relevant context from knowledge base
-        context = legal_rag.get_context_for_query(query)
+        # Get relevant context from the user's partitions only (single search, reused for citations)
+        # Search, re-ranking and partition loads block, so they run off the event loop
+        similar_docs = await run_in_threadpool(legal_rag.search_similar, query, tenant=user_id,
+                                               matters=matters, rerank=request.get("rerank"))
+        context = "\n\n".join([doc['page_content'] for doc in similar_docs])
         
         # Enhanced prompt with context
         enhanced_prompt = f"""
@@ -493,11 +883,10 @@ async def rag_chat(request: dict):
         """
         
         # Use your existing Gemini chat with memory
-        answer = call_gemini_chat_with_memory(user_id, enhanced_prompt)
+        answer = await call_gemini_chat_with_memory(user_id, enhanced_prompt)
         
-        # Also get the source documents for citations
-        similar_docs = legal_rag.search_similar(query)
-        sources = [{"content": doc.page_content[:200] + "...", "source": doc.metadata.get('source', 'Unknown')} 
+        # Source documents for citations
+        sources = [{"content": doc['page_content'][:200] + "...", "source": doc['metadata'].get('source', 'Unknown')} 
                   for doc in similar_docs]
         
         return {
@@ -506,6 +895,8 @@ async def rag_chat(request: dict):
             "has_context": len(context) > 0
         }
         
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error in /api/rag-chat: {e}")
         raise HTTPException(status_code=500, detail=f"RAG chat error: {str(e)}")
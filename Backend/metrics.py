@@ -0,0 +1,407 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tracing import record_span
+
+# Latency buckets in seconds (upper bounds). Covers fast routes like /api/login
+# up to multi-minute Gemini summaries of large PDFs.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Rollup windows exposed on the JSON endpoint, in seconds
+ROLLUP_WINDOWS = {"1m": 60, "5m": 300, "1h": 3600, "24h": 86400}
+
+
+class _Shards:
+    """Per-thread storage cells.
+
+    Each thread only ever writes to its own cell, so writers never take a lock;
+    readers sum over all cells. `dict.setdefault` is atomic in CPython, which is
+    the only shared mutation on the write path.
+    """
+
+    def __init__(self, factory: Callable):
+        self._factory = factory
+        self._cells: Dict[int, object] = {}
+
+    def local(self):
+        ident = threading.get_ident()
+        cell = self._cells.get(ident)
+        if cell is None:
+            cell = self._cells.setdefault(ident, self._factory())
+        return cell
+
+    def all(self):
+        return list(self._cells.values())
+
+
+class Counter:
+    """Monotonic counter with lock-free increments."""
+
+    def __init__(self):
+        self._shards = _Shards(lambda: [0])
+
+    def inc(self, amount: float = 1):
+        self._shards.local()[0] += amount
+
+    @property
+    def value(self) -> float:
+        return sum(cell[0] for cell in self._shards.all())
+
+
+class Gauge:
+    """Point-in-time value, either set directly or read from a callback."""
+
+    def __init__(self, fn: Optional[Callable[[], float]] = None):
+        self._value = 0.0
+        self._fn = fn
+
+    def set(self, value: float):
+        self._value = value
+
+    @property
+    def value(self) -> float:
+        if self._fn is not None:
+            try:
+                return float(self._fn())
+            except Exception:
+                return 0.0
+        return self._value
+
+
+class Histogram:
+    """Fixed-bucket histogram with lock-free observations."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        n = len(self.buckets)
+        # cell layout: [bucket counts..., +Inf count, sum]
+        self._shards = _Shards(lambda: [0] * (n + 1) + [0.0])
+
+    def observe(self, value: float):
+        cell = self._shards.local()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        """Returns (per-bucket counts incl. +Inf, total count, sum)."""
+        n = len(self.buckets) + 1
+        counts = [0] * n
+        total_sum = 0.0
+        for cell in self._shards.all():
+            for i in range(n):
+                counts[i] += cell[i]
+            total_sum += cell[-1]
+        return counts, sum(counts), total_sum
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation inside the bucket."""
+        counts, total, _ = self.snapshot()
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + c >= rank and c:
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+            lower = upper
+        return self.buckets[-1]
+
+
+class WindowedSeries:
+    """Fixed-size ring of time slots used for rolling-window rollups.
+
+    Replaces the unbounded `queries_timeline` list: memory is
+    `slots * slot_seconds` of history and never grows.
+    """
+
+    def __init__(self, slot_seconds: int = 60, slots: int = 1440):
+        self.slot_seconds = slot_seconds
+        self.slots = slots
+        # each slot: [epoch_slot, count, sum, errors]
+        self._ring = [[-1, 0, 0.0, 0] for _ in range(slots)]
+        self._lock = threading.Lock()
+
+    def record(self, value: float = 0.0, error: bool = False, now: Optional[float] = None):
+        epoch_slot = int((now or time.time()) // self.slot_seconds)
+        slot = self._ring[epoch_slot % self.slots]
+        with self._lock:
+            if slot[0] != epoch_slot:
+                slot[0], slot[1], slot[2], slot[3] = epoch_slot, 0, 0.0, 0
+            slot[1] += 1
+            slot[2] += value
+            if error:
+                slot[3] += 1
+
+    def rollup(self, seconds: int, now: Optional[float] = None) -> Dict:
+        current = int((now or time.time()) // self.slot_seconds)
+        oldest = current - max(1, seconds // self.slot_seconds) + 1
+        count, total, errors = 0, 0.0, 0
+        for epoch_slot, c, s, e in self._ring:
+            if oldest <= epoch_slot <= current:
+                count += c
+                total += s
+                errors += e
+        return {
+            "count": count,
+            "errors": errors,
+            "avg": (total / count) if count else 0.0,
+            "rate_per_s": count / seconds,
+        }
+
+    def timeline(self, seconds: int, now: Optional[float] = None) -> List[Dict]:
+        """Per-slot counts for the last `seconds`, oldest first, zero-filled."""
+        current = int((now or time.time()) // self.slot_seconds)
+        n = min(self.slots, max(1, seconds // self.slot_seconds))
+        by_slot = {slot[0]: slot for slot in self._ring}
+        points = []
+        for epoch_slot in range(current - n + 1, current + 1):
+            slot = by_slot.get(epoch_slot)
+            points.append({
+                "ts": epoch_slot * self.slot_seconds,
+                "count": slot[1] if slot else 0,
+                "avg": (slot[2] / slot[1]) if slot and slot[1] else 0.0,
+            })
+        return points
+
+
+class MetricsRegistry:
+    """In-process registry of counters, gauges, histograms and rollups.
+
+    Metrics are keyed by (name, labels) where labels is a sorted tuple of
+    (key, value) pairs, mirroring the Prometheus data model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, Counter] = {}
+        self._gauges: Dict[Tuple, Gauge] = {}
+        self._histograms: Dict[Tuple, Histogram] = {}
+        self._series: Dict[Tuple, WindowedSeries] = {}
+        self._help: Dict[str, str] = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: Optional[Dict]) -> Tuple:
+        return (name, tuple(sorted((labels or {}).items())))
+
+    def _get(self, store: Dict, name: str, labels: Optional[Dict], factory: Callable):
+        key = self._key(name, labels)
+        metric = store.get(key)
+        if metric is None:
+            with self._lock:
+                metric = store.setdefault(key, factory())
+        return metric
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def counter(self, name: str, labels: Optional[Dict] = None) -> Counter:
+        return self._get(self._counters, name, labels, Counter)
+
+    def gauge(self, name: str, labels: Optional[Dict] = None, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._get(self._gauges, name, labels, lambda: Gauge(fn))
+        if fn is not None:
+            gauge._fn = fn
+        return gauge
+
+    def histogram(self, name: str, labels: Optional[Dict] = None, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(self._histograms, name, labels, lambda: Histogram(buckets))
+
+    def series(self, name: str, labels: Optional[Dict] = None) -> WindowedSeries:
+        return self._get(self._series, name, labels, WindowedSeries)
+
+    # ---------- High-level helpers ----------
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        labels = {"method": method, "route": route}
+        error = status >= 500
+        self.counter("http_requests_total", {**labels, "status": str(status)}).inc()
+        self.histogram("http_request_duration_seconds", labels).observe(seconds)
+        self.series("http_requests", labels).record(seconds, error=error)
+        self.series("http_requests").record(seconds, error=error)
+
+    def observe_stage(self, stage: str, seconds: float):
+        self.histogram("stage_duration_seconds", {"stage": stage}).observe(seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Times a pipeline stage (extraction, chunking, embedding, faiss_search, gemini_call...).
+
+        The duration also becomes a span on the current request's trace.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe_stage(stage, seconds)
+            record_span(stage, seconds)
+
+    def record_cache(self, cache: str, hit: bool):
+        self.counter("cache_requests_total", {"cache": cache, "result": "hit" if hit else "miss"}).inc()
+
+    def record_event(self, event: str, amount: float = 1):
+        """Business events shown on the dashboard (queries, uploads, contracts...)."""
+        self.counter("events_total", {"event": event}).inc(amount)
+        self.series("events", {"event": event}).record()
+
+    def set_queue_depth(self, queue: str, depth: float):
+        self.gauge("queue_depth", {"queue": queue}).set(depth)
+
+    def register_queue(self, queue: str, fn: Callable[[], float]):
+        self.gauge("queue_depth", {"queue": queue}, fn=fn)
+
+    # ---------- Exporters ----------
+    @staticmethod
+    def _fmt_labels(labels: Tuple, extra: Tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for k, v in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    @staticmethod
+    def _fmt_num(value: float) -> str:
+        if value == float("inf"):
+            return "+Inf"
+        if float(value).is_integer():
+            return str(int(value))
+        return repr(float(value))
+
+    def render_prometheus(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        emitted = set()
+
+        def header(name: str, kind: str):
+            if name in emitted:
+                return
+            emitted.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), metric in sorted(list(self._counters.items())):
+            header(name, "counter")
+            lines.append(f"{name}{self._fmt_labels(labels)} {self._fmt_num(metric.value)}")
+
+        for (name, labels), metric in sorted(list(self._gauges.items())):
+            header(name, "gauge")
+            lines.append(f"{name}{self._fmt_labels(labels)} {self._fmt_num(metric.value)}")
+
+        for (name, labels), metric in sorted(list(self._histograms.items())):
+            header(name, "histogram")
+            counts, total, total_sum = metric.snapshot()
+            cumulative = 0
+            for bound, c in zip(metric.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = (("le", self._fmt_num(bound)),)
+                lines.append(f"{name}_bucket{self._fmt_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{self._fmt_labels(labels)} {self._fmt_num(total_sum)}")
+            lines.append(f"{name}_count{self._fmt_labels(labels)} {total}")
+
+        uptime = "process_uptime_seconds"
+        header(uptime, "gauge")
+        lines.append(f"{uptime} {self._fmt_num(round(time.time() - self.started_at, 3))}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, window: str = "24h") -> Dict:
+        """JSON view for the analytics dashboard with windowed rollups."""
+        seconds = ROLLUP_WINDOWS.get(window, ROLLUP_WINDOWS["24h"])
+
+        routes = {}
+        for (name, labels), hist in list(self._histograms.items()):
+            if name != "http_request_duration_seconds":
+                continue
+            label_map = dict(labels)
+            route_key = f"{label_map.get('method')} {label_map.get('route')}"
+            _, total, total_sum = hist.snapshot()
+            routes[route_key] = {
+                "count": total,
+                "avg_ms": round(1000 * total_sum / total, 2) if total else 0.0,
+                "p50_ms": round(1000 * hist.quantile(0.50), 2),
+                "p95_ms": round(1000 * hist.quantile(0.95), 2),
+                "p99_ms": round(1000 * hist.quantile(0.99), 2),
+                "rollups": {w: self.series("http_requests", dict(labels)).rollup(s) for w, s in ROLLUP_WINDOWS.items()},
+            }
+
+        stages = {}
+        for (name, labels), hist in list(self._histograms.items()):
+            if name != "stage_duration_seconds":
+                continue
+            _, total, total_sum = hist.snapshot()
+            stages[dict(labels)["stage"]] = {
+                "count": total,
+                "avg_ms": round(1000 * total_sum / total, 2) if total else 0.0,
+                "p95_ms": round(1000 * hist.quantile(0.95), 2),
+            }
+
+        caches: Dict[str, Dict] = {}
+        events: Dict[str, Dict] = {}
+        event_timelines: Dict[str, List[Dict]] = {}
+        for (name, labels), counter in list(self._counters.items()):
+            label_map = dict(labels)
+            if name == "cache_requests_total":
+                entry = caches.setdefault(label_map["cache"], {"hits": 0, "misses": 0})
+                entry["hits" if label_map["result"] == "hit" else "misses"] += counter.value
+            elif name == "events_total":
+                event = label_map["event"]
+                series = self.series("events", {"event": event})
+                events[event] = {
+                    "total": counter.value,
+                    "window": series.rollup(seconds)["count"],
+                }
+                event_timelines[event] = self._dashboard_timeline(series, seconds)
+        for entry in caches.values():
+            lookups = entry["hits"] + entry["misses"]
+            entry["hit_rate"] = round(entry["hits"] / lookups, 4) if lookups else 0.0
+
+        queues = {
+            dict(labels).get("queue", name): gauge.value
+            for (name, labels), gauge in list(self._gauges.items())
+            if name == "queue_depth"
+        }
+
+        overall = self.series("http_requests")
+        return {
+            "window": window,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "requests": overall.rollup(seconds),
+            "routes": routes,
+            "stages": stages,
+            "caches": caches,
+            "queues": queues,
+            "events": events,
+            "timeline": self._dashboard_timeline(overall, seconds),
+            "event_timelines": event_timelines,
+        }
+
+    @staticmethod
+    def _dashboard_timeline(series: "WindowedSeries", seconds: int) -> List[Dict]:
+        """Hourly buckets for 24h, minute buckets otherwise."""
+        timeline = series.timeline(seconds)
+        if seconds > 3600:
+            hourly: Dict[int, int] = {}
+            for point in timeline:
+                hour = point["ts"] - point["ts"] % 3600
+                hourly[hour] = hourly.get(hour, 0) + point["count"]
+            timeline = [{"ts": ts, "count": c} for ts, c in sorted(hourly.items())]
+        return timeline
+
+
+# Global registry instance
+metrics = MetricsRegistry()
+metrics.describe("http_requests_total", "Total HTTP requests by route and status.")
+metrics.describe("http_request_duration_seconds", "HTTP request latency by route.")
+metrics.describe("stage_duration_seconds", "Latency of internal pipeline stages.")
+metrics.describe("cache_requests_total", "Cache lookups by cache and result.")
+metrics.describe("queue_depth", "Current depth of internal work queues.")
+metrics.describe("events_total", "Business events (queries, uploads, contracts).")
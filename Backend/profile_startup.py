@@ -0,0 +1,71 @@
+"""
+Import-time profile for the backend.
+
+Measures how long `import main` takes in a fresh interpreter, i.e. what every
+uvicorn worker and every --reload pays before it can serve `/` or `/api/login`.
+
+    python profile_startup.py            # current (lazy) startup
+    python profile_startup.py --eager    # simulate the old eager startup
+    python profile_startup.py --top 15   # show the 15 slowest imports
+
+--eager additionally imports the heavy dependencies and loads the embedding
+model at import time, which is what main.py used to do, so the two runs give
+a before/after comparison on the same machine.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["sentence_transformers", "faiss", "pdfminer.high_level", "PyPDF2", "docx", "google.generativeai"]
+
+def run_import(eager: bool):
+    code = "import main"
+    if eager:
+        code += "\n" + "\n".join(f"import {m}" for m in HEAVY_MODULES)
+        code += "\nfrom rag_service import get_embedding_model; get_embedding_model()"
+
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "profile-dummy-key")
+    env["WARMUP_ON_STARTUP"] = "0"
+
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit(f"❌ import failed (exit {proc.returncode})")
+    return wall, proc.stderr
+
+def parse_importtime(stderr: str):
+    """Returns [(cumulative_us, module)] for top-level lines of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)", line)
+        if m:
+            rows.append((int(m.group(2)), m.group(4)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile backend cold-start import time")
+    parser.add_argument("--eager", action="store_true", help="simulate the old eager imports")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    args = parser.parse_args()
+
+    wall, stderr = run_import(args.eager)
+    rows = parse_importtime(stderr)
+
+    mode = "eager (before)" if args.eager else "lazy (after)"
+    print(f"⏱️  Cold start [{mode}]: {wall:.2f}s wall clock")
+    print(f"   {'cumulative':>12}  module")
+    for cumulative_us, module in sorted(rows, reverse=True)[:args.top]:
+        print(f"   {cumulative_us / 1e6:>11.3f}s  {module}")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,139 @@
 
 import os
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
-from typing import List, Dict
+import re
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Optional
 import json
+from embeddings import EMBEDDING_BACKEND
+from metrics import metrics
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# "local" (model and indexes in this process) or "sidecar" (thin client of
+# embedding_server.py over EMBEDDING_SOCKET, shared by every web worker)
+RAG_BACKEND = os.getenv("RAG_BACKEND", "local")
+# Failed warm-ups (e.g. the sidecar is not up yet) are retried with exponential backoff
+WARMUP_RETRY_INITIAL_S = float(os.getenv("WARMUP_RETRY_INITIAL_S", "2"))
+WARMUP_RETRY_MAX_S = float(os.getenv("WARMUP_RETRY_MAX_S", "60"))
+
+# Heavy dependencies (sentence_transformers/torch, faiss) are imported on first
+# use so that importing this module - and therefore main.py - stays fast.
+_model_lock = threading.Lock()
+_embedding_model = None
+_warmup_state = {"status": "cold", "seconds": None, "error": None, "reranker_error": None, "attempts": 0}
+
+def get_local_embedding_model():
+    """Returns the in-process SentenceTransformer, loading it on first call."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _model_lock:
+            if _embedding_model is None:
+                print(f"🔄 Loading embedding model ({EMBEDDING_BACKEND} backend)...")
+                from embeddings import load_embedding_model
+                with metrics.stage("model_load"):
+                    _embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+                print("✅ Embedding model loaded!")
+    return _embedding_model
+
+def get_embedding_model():
+    """Returns the shared embedding model (the sidecar's encoder when RAG_BACKEND=sidecar)."""
+    if RAG_BACKEND == "sidecar":
+        from embedding_server import remote_encoder
+        return remote_encoder()
+    return get_local_embedding_model()
+
+def is_model_loaded() -> bool:
+    if RAG_BACKEND == "sidecar":
+        return _warmup_state["status"] == "ready"
+    return _embedding_model is not None
+
+def warm_up():
+    """Eagerly loads heavy subsystems; meant to run in a background thread after startup."""
+    _warmup_state["status"] = "warming"
+    _warmup_state["attempts"] += 1
+    start = time.perf_counter()
+    try:
+        import faiss  # noqa: F401
+        get_embedding_model().encode(["warm-up"])
+    except Exception as e:
+        _warmup_state["status"] = "failed"
+        _warmup_state["error"] = str(e)
+        _warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+        return dict(_warmup_state)
+    from reranker import reranker, RERANK_ENABLED
+    # In sidecar mode the re-ranker lives in the embedding server
+    if RERANK_ENABLED and RAG_BACKEND != "sidecar":
+        try:
+            reranker.warm_up()
+        except Exception as e:
+            # Optional: searches fall back to first-stage order, so the service is still ready
+            _warmup_state["reranker_error"] = str(e)
+    _warmup_state["status"] = "ready"
+    _warmup_state["error"] = None
+    _warmup_state["seconds"] = round(time.perf_counter() - start, 3)
+    return dict(_warmup_state)
+
+def warm_up_until_ready(stop: Optional[threading.Event] = None) -> Dict:
+    """Runs warm_up until it succeeds, backing off between failed attempts.
+
+    Readiness recovers by itself once a transient cause (sidecar still
+    starting, model download hiccup) goes away, instead of staying failed.
+    """
+    stop = stop or threading.Event()
+    delay = WARMUP_RETRY_INITIAL_S
+    while True:
+        state = warm_up()
+        if state["status"] == "ready":
+            return state
+        print(f"⚠️ Warm-up failed ({state['error']}); retrying in {delay:.1f}s")
+        if stop.wait(delay):
+            return state
+        delay = min(delay * 2, WARMUP_RETRY_MAX_S)
+
+def warmup_status() -> Dict:
+    return {**_warmup_state, "embedding_model_loaded": is_model_loaded()}
+
+KNOWLEDGE_DIR = os.getenv("KNOWLEDGE_DIR", "./knowledge_base")
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """Split text into overlapping chunks"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+        start += chunk_size - overlap
+    return chunks
 
 class SimpleLegalRAG:
-    def __init__(self):
-        print("🔄 Loading embedding model...")
-        self.embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+    def __init__(self, persist_dir: str = None):
         self.documents = []
         self.metadata = []
         self.index = None
-        print("✅ RAG system ready!")
+        self.persist_dir = persist_dir
+        self._loaded = persist_dir is None
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._text_bytes = 0
+        # Rows and chunk-segment bytes already persisted (see save)
+        self._saved_count = 0
+        self._chunks_bytes = 0
+
+    @property
+    def embedding_model(self):
+        return get_local_embedding_model()
+
+    def _ensure_loaded(self):
+        """Loads the persisted index (if any) on first use."""
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self.load()
+                self._loaded = True
         
     def add_document(self, text: str, metadata: Dict = None):
         """Add document to knowledge base"""
@@ -21,60 +141,71 @@ class SimpleLegalRAG:
             metadata = {"source": "user_upload", "type": "legal_document"}
         
         # Simple chunking
-        chunks = self._chunk_text(text)
-        
-        for chunk in chunks:
-            self.documents.append(chunk)
-            self.metadata.append(metadata)
-        
-        # Update FAISS index
-        self._update_index()
+        with metrics.stage("chunking"):
+            chunks = self._chunk_text(text)
+        if not chunks:
+            return 0
+
+        with metrics.stage("embedding"):
+            embeddings = self.embedding_model.encode(chunks)
+
+        # Update FAISS index with the new chunks only
+        self.add_embeddings(chunks, embeddings, [metadata] * len(chunks))
         
         return len(chunks)
     
     def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200):
         """Split text into overlapping chunks"""
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunks.append(text[start:end])
-            start += chunk_size - overlap
-        return chunks
+        return chunk_text(text, chunk_size, overlap)
     
-    def _update_index(self):
-        """Update FAISS index with all documents"""
-        if not self.documents:
-            return
-            
-        print(f"🔄 Updating index with {len(self.documents)} documents...")
-        embeddings = self.embedding_model.encode(self.documents)
+    def add_embeddings(self, chunks: List[str], embeddings, metadata: List[Dict]):
+        """Append pre-computed chunk embeddings to the FAISS index."""
+        import faiss
+        self._ensure_loaded()
         embeddings = embeddings.astype('float32')
-        
-        # Create or update index
+        with self._lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatL2(embeddings.shape[1])
+            self.index.add(embeddings)
+            self.documents.extend(chunks)
+            self.metadata.extend(metadata)
+            self._text_bytes += sum(len(c) for c in chunks)
+            self._dirty = True
+
+    def memory_bytes(self) -> int:
+        """Approximate resident size: float32 vectors plus chunk text."""
         if self.index is None:
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        
-        self.index.add(embeddings)
-        print("✅ Index updated!")
+            return self._text_bytes
+        return self.index.ntotal * self.index.d * 4 + self._text_bytes
     
     def search_similar(self, query: str, k: int = 3):
         """Search for similar legal content"""
+        self._ensure_loaded()
         if not self.documents:
             return []
             
-        query_embedding = self.embedding_model.encode([query])
+        with metrics.stage("embedding"):
+            query_embedding = self.embedding_model.encode([query])
+        return self.search_by_embedding(query_embedding, k)
+
+    def search_by_embedding(self, query_embedding, k: int = 3):
+        """Search with a pre-computed query embedding; results carry their L2 `score`."""
+        self._ensure_loaded()
+        if not self.documents:
+            return []
         query_embedding = query_embedding.astype('float32')
         
         # Search
-        distances, indices = self.index.search(query_embedding, k)
+        with metrics.stage("faiss_search"):
+            distances, indices = self.index.search(query_embedding, k)
         
         results = []
-        for idx in indices[0]:
-            if idx < len(self.documents):
+        for dist, idx in zip(distances[0], indices[0]):
+            if 0 <= idx < len(self.documents):
                 results.append({
                     'page_content': self.documents[idx],
-                    'metadata': self.metadata[idx]
+                    'metadata': self.metadata[idx],
+                    'score': float(dist)
                 })
         
         return results
@@ -85,5 +216,256 @@ class SimpleLegalRAG:
         context = "\n\n".join([doc['page_content'] for doc in similar_docs])
         return context
 
-# Global RAG instance
-legal_rag = SimpleLegalRAG()
\ No newline at end of file
+    # ---------- Persistence ----------
+    # A partition is stored as append-only segments, so a save costs the chunks
+    # added since the previous save rather than the whole partition:
+    #   vectors.f32   raw float32 rows (the IndexFlatL2 is rebuilt from them on load)
+    #   chunks.jsonl  one {"text", "metadata"} record per row
+    #   store.json    commit record {"count", "dim", "chunks_bytes"}, replaced atomically
+    # Only the committed prefix of each segment is read; bytes past it (a save
+    # that crashed before its commit) are truncated by the next save.
+    def _paths(self):
+        return (os.path.join(self.persist_dir, "vectors.f32"), os.path.join(self.persist_dir, "chunks.jsonl"),
+                os.path.join(self.persist_dir, "store.json"))
+
+    def save(self):
+        """Appends the chunks added since the last save, then commits the new row count."""
+        if not self.persist_dir or self.index is None:
+            return
+        os.makedirs(self.persist_dir, exist_ok=True)
+        vectors_path, chunks_path, store_path = self._paths()
+        with self._lock:
+            saved, total = self._saved_count, self.index.ntotal
+            if total > saved:
+                with metrics.stage("index_save"):
+                    vectors = self.index.reconstruct_n(saved, total - saved)
+                    with open(vectors_path, "ab") as f:
+                        f.truncate(saved * self.index.d * 4)
+                        f.write(vectors.astype("<f4").tobytes())
+                        f.flush()
+                        os.fsync(f.fileno())
+                    with open(chunks_path, "ab") as f:
+                        f.truncate(self._chunks_bytes)
+                        for text, meta in zip(self.documents[saved:total], self.metadata[saved:total]):
+                            f.write((json.dumps({"text": text, "metadata": meta}) + "\n").encode("utf-8"))
+                        f.flush()
+                        os.fsync(f.fileno())
+                        chunks_bytes = f.tell()
+                    with open(store_path + ".tmp", "w", encoding="utf-8") as f:
+                        json.dump({"count": total, "dim": self.index.d, "chunks_bytes": chunks_bytes}, f)
+                    os.replace(store_path + ".tmp", store_path)
+                self._saved_count, self._chunks_bytes = total, chunks_bytes
+                # Partitions written by older versions are migrated on their first save
+                for legacy in ("index.faiss", "chunks.json"):
+                    if os.path.exists(os.path.join(self.persist_dir, legacy)):
+                        os.remove(os.path.join(self.persist_dir, legacy))
+            self._dirty = False
+
+    def load(self):
+        vectors_path, chunks_path, store_path = self._paths()
+        if not os.path.exists(store_path):
+            self._load_legacy()
+            return
+        import faiss
+        import numpy as np
+        with metrics.stage("index_load"):
+            with open(store_path, encoding="utf-8") as f:
+                store = json.load(f)
+            count, dim = store["count"], store["dim"]
+            vectors = np.fromfile(vectors_path, dtype="<f4", count=count * dim).reshape(count, dim)
+            with open(chunks_path, "rb") as f:
+                records = [json.loads(line) for line in f.read(store["chunks_bytes"]).splitlines()]
+            self.index = faiss.IndexFlatL2(dim)
+            self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        self.documents = [r["text"] for r in records]
+        self.metadata = [r["metadata"] for r in records]
+        self._saved_count, self._chunks_bytes = count, store["chunks_bytes"]
+        self._text_bytes = sum(len(d) for d in self.documents)
+        print(f"✅ Loaded knowledge base with {len(self.documents)} chunks")
+
+    def _load_legacy(self):
+        """Reads the old whole-file format (index.faiss + chunks.json); the next save migrates it."""
+        index_path = os.path.join(self.persist_dir, "index.faiss")
+        store_path = os.path.join(self.persist_dir, "chunks.json")
+        if not (os.path.exists(index_path) and os.path.exists(store_path)):
+            return
+        import faiss
+        with metrics.stage("index_load"):
+            with open(store_path, encoding="utf-8") as f:
+                store = json.load(f)
+            self.index = faiss.read_index(index_path)
+        self.documents = store["documents"]
+        self.metadata = store["metadata"]
+        self._text_bytes = sum(len(d) for d in self.documents)
+        self._dirty = True
+        print(f"✅ Loaded knowledge base with {len(self.documents)} chunks")
+
+    def reload(self):
+        """Discards unsaved additions by re-reading the persisted index (no-op without persist_dir)."""
+        if not self.persist_dir:
+            return
+        with self._lock:
+            self.documents, self.metadata, self.index = [], [], None
+            self._text_bytes = 0
+            self._saved_count, self._chunks_bytes = 0, 0
+            self._dirty = False
+            self.load()
+
+# ---------- Partitioned knowledge bases ----------
+DEFAULT_MATTER = "general"
+# Total memory allowed for loaded partitions before least-recently-used ones are evicted
+RAG_MEMORY_BUDGET_MB = int(os.getenv("RAG_MEMORY_BUDGET_MB", "1024"))
+
+def _safe_name(name: str) -> str:
+    """Maps a tenant/matter ID to a safe directory name."""
+    name = str(name)
+    if re.fullmatch(r"[A-Za-z0-9_.-]{1,64}", name) and name not in (".", ".."):
+        return name
+    return "h-" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+class PartitionedLegalRAG:
+    """Knowledge base split into one SimpleLegalRAG per (tenant, matter).
+
+    Partitions are persisted under KNOWLEDGE_DIR/tenants/<tenant>/<matter>,
+    loaded on first use and evicted least-recently-used (after saving) when
+    the loaded set exceeds the memory budget. A search only touches the
+    caller's own partitions, so latency scales with that tenant's corpus.
+    """
+
+    def __init__(self, root_dir: str = KNOWLEDGE_DIR, memory_budget_mb: int = RAG_MEMORY_BUDGET_MB):
+        self.root_dir = os.path.join(root_dir, "tenants")
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._partitions: "OrderedDict[tuple, SimpleLegalRAG]" = OrderedDict()
+        self._pins: Dict[tuple, int] = {}
+        self._lock = threading.RLock()
+        metrics.gauge("rag_partitions_loaded", fn=lambda: len(self._partitions))
+        metrics.gauge("rag_partitions_bytes", fn=self.loaded_bytes)
+
+    @property
+    def embedding_model(self):
+        return get_local_embedding_model()
+
+    def partition_dir(self, tenant: str, matter: str) -> str:
+        return os.path.join(self.root_dir, _safe_name(tenant), _safe_name(matter))
+
+    def list_matters(self, tenant: str) -> List[str]:
+        """Matters of a tenant that exist on disk or in memory (directory names)."""
+        tenant_dir = os.path.join(self.root_dir, _safe_name(tenant))
+        matters = set(os.listdir(tenant_dir)) if os.path.isdir(tenant_dir) else set()
+        with self._lock:
+            matters.update(m for t, m in self._partitions if t == _safe_name(tenant))
+        return sorted(matters)
+
+    def has_partition(self, tenant: str, matter: str) -> bool:
+        """Whether the partition is loaded or has a persisted index (reads never create one)."""
+        with self._lock:
+            if (_safe_name(tenant), _safe_name(matter)) in self._partitions:
+                return True
+        partition_dir = self.partition_dir(tenant, matter)
+        return any(os.path.exists(os.path.join(partition_dir, name)) for name in ("store.json", "index.faiss"))
+
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(p.memory_bytes() for p in self._partitions.values())
+
+    @contextmanager
+    def partition(self, tenant: str, matter: str = DEFAULT_MATTER):
+        """Yields the (tenant, matter) partition, pinned so it cannot be evicted while in use.
+
+        The partition is created if needed, so this is for writes; a partition
+        left without any documents is dropped again when released.
+        """
+        key = (_safe_name(tenant), _safe_name(matter))
+        with self._lock:
+            rag = self._partitions.get(key)
+            metrics.record_cache("rag_partition", rag is not None)
+            if rag is None:
+                rag = SimpleLegalRAG(persist_dir=self.partition_dir(tenant, matter))
+                self._partitions[key] = rag
+            self._partitions.move_to_end(key)
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            rag._ensure_loaded()
+            yield rag
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                    if rag.index is None and not rag._dirty and self._partitions.get(key) is rag:
+                        self._partitions.pop(key, None)
+            self._evict()
+
+    def _evict(self):
+        """Drops least-recently-used, unpinned partitions until under the memory budget."""
+        while True:
+            with self._lock:
+                if self.loaded_bytes() <= self.memory_budget:
+                    return
+                victim = next((k for k in self._partitions if k not in self._pins), None)
+                if victim is None:
+                    return
+                rag = self._partitions.pop(victim)
+                # Save under the lock so a concurrent reload cannot read stale files
+                if rag._dirty:
+                    rag.save()
+            metrics.counter("rag_partition_evictions_total").inc()
+
+    def add_document(self, text: str, metadata: Dict = None, tenant: str = "default_user",
+                     matter: str = DEFAULT_MATTER) -> int:
+        with self.partition(tenant, matter) as rag:
+            return rag.add_document(text, metadata)
+
+    def save(self, tenant: Optional[str] = None, matter: Optional[str] = None):
+        """Saves one partition, or every dirty loaded partition."""
+        with self._lock:
+            targets = [rag for (t, m), rag in self._partitions.items()
+                       if (tenant is None or t == _safe_name(tenant))
+                       and (matter is None or m == _safe_name(matter))]
+        for rag in targets:
+            if rag._dirty:
+                rag.save()
+
+    def search_similar(self, query: str, tenant: str = "default_user",
+                       matters: Optional[List[str]] = None, k: int = 3,
+                       rerank: Optional[bool] = None, query_embedding=None):
+        """Searches only the given matters of a tenant (all of its matters by default).
+
+        With re-ranking (RERANK_ENABLED or rerank=True), RERANK_CANDIDATES hits
+        are fetched and re-ordered by the cross-encoder before taking top-k.
+        `query_embedding` skips encoding the query (the sidecar batches it).
+        """
+        from reranker import reranker, RERANK_ENABLED, RERANK_CANDIDATES
+        rerank = RERANK_ENABLED if rerank is None else rerank
+        fetch_k = max(k, RERANK_CANDIDATES) if rerank else k
+
+        # Unknown matters are skipped rather than created as empty partitions
+        matters = [m for m in (matters or self.list_matters(tenant)) if self.has_partition(tenant, m)]
+        if not matters:
+            return []
+        if query_embedding is None:
+            with metrics.stage("embedding"):
+                query_embedding = self.embedding_model.encode([query])
+        results = []
+        for matter in matters:
+            with self.partition(tenant, matter) as rag:
+                for hit in rag.search_by_embedding(query_embedding, fetch_k):
+                    hit["metadata"] = {**hit["metadata"], "matter": matter}
+                    results.append(hit)
+        results.sort(key=lambda r: r["score"])
+        results = results[:fetch_k]
+        if rerank:
+            return reranker.rerank(query, results, k)
+        return results[:k]
+
+    def get_context_for_query(self, query: str, tenant: str = "default_user",
+                              matters: Optional[List[str]] = None) -> str:
+        similar_docs = self.search_similar(query, tenant, matters)
+        return "\n\n".join([doc['page_content'] for doc in similar_docs])
+
+# Global RAG store (model and partitions are loaded lazily on first use)
+if RAG_BACKEND == "sidecar":
+    from embedding_server import SidecarLegalRAG
+    legal_rag = SidecarLegalRAG()
+else:
+    legal_rag = PartitionedLegalRAG()
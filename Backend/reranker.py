@@ -0,0 +1,138 @@
+"""
+Optional second-stage re-ranking of retrieved chunks with a CPU cross-encoder.
+
+The bi-encoder + FAISS stage over-fetches candidates; the cross-encoder scores
+each (query, chunk) pair jointly, which is much better at putting the
+operative clause above boilerplate. Scores are cached per (query, chunk) and
+scoring stops when the per-request latency budget is used up, in which case
+the first-stage order is kept.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# How many first-stage candidates to fetch and re-rank
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "50000"))
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class ScoreCache:
+    """Thread-safe LRU of (query hash, chunk id) -> cross-encoder score."""
+
+    def __init__(self, maxsize: int = RERANK_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._items.get(key)
+            if score is not None:
+                self._items.move_to_end(key)
+            return score
+
+    def put(self, key: Tuple[str, str], score: float):
+        with self._lock:
+            self._items[key] = score
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: float = RERANK_BUDGET_MS, cache: Optional[ScoreCache] = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.cache = cache or ScoreCache()
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._loading = False
+
+    def _load(self):
+        with self._load_lock:
+            try:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    print(f"🔄 Loading re-ranker {self.model_name}...")
+                    self._model = CrossEncoder(self.model_name, max_length=512, device="cpu")
+                    print("✅ Re-ranker loaded!")
+            except Exception as e:
+                # Requests keep the first-stage order; the next one retries the load
+                metrics.counter("rerank_load_errors_total").inc()
+                print(f"⚠️ Could not load re-ranker {self.model_name}: {e}")
+                raise
+            finally:
+                self._loading = False
+        return self._model
+
+    def warm_up(self):
+        self._load()
+
+    @staticmethod
+    def chunk_id(result: Dict) -> str:
+        meta = result.get("metadata") or {}
+        return f"{meta.get('hash', '')}:{_digest(result['page_content'])}"
+
+    def rerank(self, query: str, candidates: List[Dict], k: int, budget_ms: Optional[float] = None) -> List[Dict]:
+        """Returns the top-k candidates by cross-encoder score.
+
+        Falls back to first-stage order if the model is still loading or the
+        latency budget runs out before every candidate is scored.
+        """
+        if len(candidates) <= 1:
+            return candidates[:k]
+        if self._model is None:
+            # Never make a request wait for the model download/load
+            if not self._loading:
+                self._loading = True
+                threading.Thread(target=self._load, name="reranker-load", daemon=True).start()
+            metrics.counter("rerank_fallbacks_total", {"reason": "cold"}).inc()
+            return candidates[:k]
+
+        budget = (budget_ms if budget_ms is not None else self.budget_ms) / 1000.0
+        start = time.perf_counter()
+        query_hash = _digest(query)
+        keys = [(query_hash, self.chunk_id(c)) for c in candidates]
+        scores: List[Optional[float]] = []
+        for key in keys:
+            score = self.cache.get(key)
+            metrics.record_cache("rerank_scores", score is not None)
+            scores.append(score)
+
+        missing = [i for i, s in enumerate(scores) if s is None]
+        with metrics.stage("rerank"):
+            for b in range(0, len(missing), self.batch_size):
+                if time.perf_counter() - start > budget:
+                    metrics.counter("rerank_fallbacks_total", {"reason": "budget"}).inc()
+                    return candidates[:k]
+                batch = missing[b:b + self.batch_size]
+                pairs = [(query, candidates[i]["page_content"]) for i in batch]
+                batch_scores = self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = float(score)
+                    self.cache.put(keys[i], float(score))
+
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda p: -p[0])
+        results = []
+        for score, i in ranked[:k]:
+            results.append({**candidates[i], "rerank_score": score})
+        return results
+
+
+# Global re-ranker (model is loaded lazily)
+reranker = CrossEncoderReranker()
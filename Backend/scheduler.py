@@ -0,0 +1,240 @@
+"""
+Admission control and priority scheduling for LLM (Gemini) calls.
+
+At most LLM_MAX_CONCURRENCY calls run at once. Callers beyond that wait in a
+bounded queue per priority class: interactive chat is always served before
+batch work, and within a class users are served round-robin so one heavy
+user cannot starve the rest. Requests whose expected wait would exceed their
+class deadline are shed immediately with LLMOverloaded, which the API turns
+into a fast 503 with Retry-After instead of a slow timeout.
+
+Request handlers wait with `slot_async` on the event loop, so a queued call
+holds no worker thread and the queue bounds and deadlines apply before any
+threadpool capacity is used. Blocking `slot` is for background job threads.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from metrics import metrics
+from tracing import record_span
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+
+class PriorityClass:
+    def __init__(self, name: str, rank: int, max_queue: int, max_wait_s: float):
+        self.name = name
+        self.rank = rank            # lower is served first
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+
+
+DEFAULT_CLASSES = {
+    "interactive": PriorityClass(
+        "interactive", 0,
+        int(os.getenv("LLM_QUEUE_INTERACTIVE", "64")),
+        float(os.getenv("LLM_DEADLINE_INTERACTIVE_S", "15")),
+    ),
+    "batch": PriorityClass(
+        "batch", 1,
+        int(os.getenv("LLM_QUEUE_BATCH", "32")),
+        float(os.getenv("LLM_DEADLINE_BATCH_S", "60")),
+    ),
+}
+
+
+class LLMOverloaded(Exception):
+    """Raised when a call is shed; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("user_id", "deadline", "granted", "enqueued_at", "loop", "future")
+
+    def __init__(self, user_id: str, deadline: Optional[float],
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.user_id = user_id
+        self.deadline = deadline
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+        # Async waiters are woken through their loop; sync waiters through the condition
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 classes: Optional[Dict[str, PriorityClass]] = None):
+        self.max_concurrency = max_concurrency
+        self.classes = classes or DEFAULT_CLASSES
+        self._by_rank = sorted(self.classes.values(), key=lambda c: c.rank)
+        self._cond = threading.Condition()
+        self._active = 0
+        # class name -> user -> FIFO of tickets; OrderedDict order is the round-robin order
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {c: OrderedDict() for c in self.classes}
+        self._depth: Dict[str, int] = {c: 0 for c in self.classes}
+        # EWMA of call duration, used to estimate queueing delay
+        self._avg_service_s = 2.0
+        for name in self.classes:
+            metrics.register_queue(f"llm_{name}", lambda n=name: self._depth[n])
+        metrics.gauge("llm_active_calls", fn=lambda: self._active)
+
+    def _waiting_ahead(self, cls: PriorityClass) -> int:
+        return sum(self._depth[c.name] for c in self._by_rank if c.rank <= cls.rank)
+
+    def _estimated_wait(self, cls: PriorityClass) -> float:
+        ahead = self._waiting_ahead(cls) + 1
+        return ahead * self._avg_service_s / self.max_concurrency
+
+    def _shed(self, cls: PriorityClass, reason: str):
+        metrics.counter("llm_shed_total", {"class": cls.name, "reason": reason}).inc()
+        retry_after = max(1, math.ceil(self._estimated_wait(cls)))
+        raise LLMOverloaded(f"LLM capacity exhausted ({reason}); please retry", retry_after)
+
+    def _admit(self, cls: PriorityClass, user_id: str, shed: bool,
+               loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Ticket]:
+        """Takes a free slot (returns None) or enqueues a ticket. Caller holds the lock.
+
+        With shed=True the call is rejected up front if the class queue is full
+        or the expected wait exceeds the class deadline.
+        """
+        if self._active < self.max_concurrency and self._waiting_ahead(cls) == 0:
+            self._active += 1
+            metrics.histogram("llm_queue_wait_seconds", {"class": cls.name}).observe(0.0)
+            return None
+        if shed:
+            if self._depth[cls.name] >= cls.max_queue:
+                self._shed(cls, "queue_full")
+            if self._estimated_wait(cls) > cls.max_wait_s:
+                self._shed(cls, "deadline")
+        ticket = _Ticket(user_id, time.monotonic() + cls.max_wait_s if shed else None, loop)
+        self._queues[cls.name].setdefault(user_id, deque()).append(ticket)
+        self._depth[cls.name] += 1
+        return ticket
+
+    def _observe_wait(self, cls: PriorityClass, ticket: _Ticket):
+        waited = time.monotonic() - ticket.enqueued_at
+        metrics.histogram("llm_queue_wait_seconds", {"class": cls.name}).observe(waited)
+        record_span("llm_queue", waited)
+
+    def acquire(self, priority: str = "interactive", user_id: str = "default_user", shed: bool = True):
+        """Blocks the calling thread until a call slot is granted.
+
+        With shed=True the call is also abandoned if the class deadline passes
+        while queued. shed=False (background jobs) waits as long as needed.
+        """
+        cls = self.classes[priority]
+        with self._cond:
+            ticket = self._admit(cls, user_id, shed)
+            if ticket is None:
+                return
+            while not ticket.granted:
+                timeout = None if ticket.deadline is None else ticket.deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    self._remove(cls.name, ticket)
+                    self._shed(cls, "expired")
+                self._cond.wait(timeout)
+        self._observe_wait(cls, ticket)
+
+    async def acquire_async(self, priority: str = "interactive", user_id: str = "default_user",
+                            shed: bool = True):
+        """Waits for a call slot on the event loop, without holding a worker thread."""
+        cls = self.classes[priority]
+        with self._cond:
+            ticket = self._admit(cls, user_id, shed, asyncio.get_running_loop())
+        if ticket is None:
+            return
+        try:
+            timeout = None if ticket.deadline is None else max(0.0, ticket.deadline - time.monotonic())
+            await asyncio.wait_for(ticket.future, timeout)
+        except asyncio.TimeoutError:
+            with self._cond:
+                # A grant that raced the deadline keeps its slot
+                if not ticket.granted:
+                    self._remove(cls.name, ticket)
+                    self._shed(cls, "expired")
+        except BaseException:
+            # Cancelled (e.g. client disconnected): give back a slot we may have been granted
+            with self._cond:
+                if ticket.granted:
+                    self._active -= 1
+                    self._grant_next()
+                else:
+                    self._remove(cls.name, ticket)
+            raise
+        self._observe_wait(cls, ticket)
+
+    def _remove(self, cls_name: str, ticket: _Ticket):
+        user_queue = self._queues[cls_name].get(ticket.user_id)
+        if user_queue is not None and ticket in user_queue:
+            user_queue.remove(ticket)
+            self._depth[cls_name] -= 1
+            if not user_queue:
+                del self._queues[cls_name][ticket.user_id]
+
+    def release(self, service_s: Optional[float] = None):
+        with self._cond:
+            self._active -= 1
+            if service_s is not None:
+                self._avg_service_s = 0.8 * self._avg_service_s + 0.2 * service_s
+            self._grant_next()
+
+    def _grant_next(self):
+        """Grants free slots: highest class first, round-robin across users within a class."""
+        while self._active < self.max_concurrency:
+            for cls in self._by_rank:
+                users = self._queues[cls.name]
+                if users:
+                    user_id, user_queue = next(iter(users.items()))
+                    ticket = user_queue.popleft()
+                    self._depth[cls.name] -= 1
+                    del users[user_id]
+                    if user_queue:
+                        users[user_id] = user_queue  # back of the round-robin order
+                    ticket.granted = True
+                    self._active += 1
+                    if ticket.future is not None:
+                        ticket.loop.call_soon_threadsafe(_wake, ticket.future)
+                    break
+            else:
+                break
+        self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", user_id: str = "default_user", shed: bool = True):
+        """Context manager around one LLM call (blocking; for worker/job threads)."""
+        self.acquire(priority, user_id, shed)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def slot_async(self, priority: str = "interactive", user_id: str = "default_user",
+                         shed: bool = True):
+        """Async context manager around one LLM call; queueing happens on the event loop."""
+        await self.acquire_async(priority, user_id, shed)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+
+# Global scheduler shared by every Gemini call site
+llm_scheduler = LLMScheduler()
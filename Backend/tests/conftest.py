@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Module-level singletons (job manager, artifact store) must not touch the working tree
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(_scratch, "jobs.db"))
+os.environ.setdefault("JOBS_DIR", os.path.join(_scratch, "job_data"))
+os.environ.setdefault("ARTIFACT_DIR", os.path.join(_scratch, "artifact_cache"))
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import pytest
+
+from artifacts import ArtifactStore
+from metrics import metrics
+
+DOC_A = "a" * 64
+DOC_B = "b" * 64
+DOC_C = "c" * 64
+
+
+def cache_count(name, result):
+    return metrics.counter("cache_requests_total", {"cache": f"artifact_{name}", "result": result}).value
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / "artifacts"))
+
+
+def test_get_or_compute_counts_one_miss_then_hits(store):
+    calls = []
+    assert store.get_or_compute(DOC_A, "t_count", lambda: calls.append(1) or "text") == "text"
+    assert store.get_or_compute(DOC_A, "t_count", lambda: calls.append(1) or "other") == "text"
+    assert calls == [1]
+    assert cache_count("t_count", "miss") == 1
+    assert cache_count("t_count", "hit") == 1
+
+
+def test_concurrent_callers_share_one_computation(store):
+    calls = []
+    gate = threading.Event()
+
+    def compute():
+        calls.append(1)
+        gate.wait(5)
+        return {"label": "nda"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.get_or_compute(DOC_A, "t_share", compute)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == [{"label": "nda"}] * 4
+
+
+def test_failed_computation_stores_nothing(store):
+    def fail():
+        raise RuntimeError("parse error")
+
+    with pytest.raises(RuntimeError):
+        store.get_or_compute(DOC_A, "t_fail", fail)
+    assert store.get(DOC_A, "t_fail") is None
+
+
+def test_disk_tier_survives_a_new_store(store):
+    store.put(DOC_A, "t_disk", "extracted text")
+    fresh = ArtifactStore(store.directory)
+    assert fresh.get(DOC_A, "t_disk") == "extracted text"
+    assert fresh.get(DOC_A, "t_missing") is None
+
+
+def test_memory_tier_evicts_least_recently_used(store):
+    store.memory_budget = 10
+    store.put(DOC_A, "t_mem", "aaaa")
+    store.put(DOC_B, "t_mem", "bbbb")
+    store.get(DOC_A, "t_mem")  # A is now most recent
+    store.put(DOC_C, "t_mem", "cccc")
+    assert [key[0] for key in store._memory] == [DOC_A, DOC_C]
+    assert store._memory_bytes == 8
+
+
+def test_disk_tier_evicts_least_recently_used_documents(store):
+    store.put(DOC_A, "t_lru", "x" * 100)
+    store.put(DOC_B, "t_lru", "y" * 100)
+    past = time.time() - 60
+    os.utime(store._doc_dir(DOC_A), (past, past))
+    store.disk_budget = 150
+    store.put(DOC_C, "t_lru", "z" * 100)
+    # Oldest first until under budget; the document just written is kept
+    assert not os.path.exists(store._doc_dir(DOC_A))
+    assert not os.path.exists(store._doc_dir(DOC_B))
+    assert os.path.exists(store._doc_dir(DOC_C))
+    assert store._disk_bytes == 100
+
+
+def test_disk_tier_expires_documents_past_ttl(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"), ttl_days=1)
+    store.put(DOC_A, "t_ttl", "old")
+    stale = time.time() - 2 * 86400
+    os.utime(store._doc_dir(DOC_A), (stale, stale))
+    store._last_sweep = 0  # force the periodic sweep on the next write
+    store.put(DOC_B, "t_ttl", "new")
+    assert not os.path.exists(store._doc_dir(DOC_A))
+    assert os.path.exists(store._doc_dir(DOC_B))
@@ -0,0 +1,65 @@
+import importlib
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("jose")
+pytest.importorskip("passlib")
+pytest.importorskip("sqlalchemy")
+
+
+@pytest.fixture(scope="module")
+def auth(tmp_path_factory):
+    # database.py creates ./users.db on import; keep it out of the working tree
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp("auth"))
+        return importlib.import_module("auth")
+
+
+def test_cached_claims_expire_with_the_token(auth):
+    cache = auth.TokenCache()
+    cache.put("live", {"sub": "1", "exp": time.time() + 60})
+    cache.put("stale", {"sub": "2", "exp": time.time() - 1})
+    assert cache.get("live")["sub"] == "1"
+    assert cache.get("stale") is None
+    assert "stale" not in cache._items
+    assert cache.get("unknown") is None
+
+
+def test_cache_is_bounded_lru(auth):
+    cache = auth.TokenCache(maxsize=2)
+    exp = time.time() + 60
+    cache.put("a", {"exp": exp})
+    cache.put("b", {"exp": exp})
+    cache.get("a")
+    cache.put("c", {"exp": exp})
+    assert list(cache._items) == ["a", "c"]
+
+
+def test_decode_token_uses_cache_until_expiry(auth, monkeypatch):
+    from jose import jwt
+
+    monkeypatch.setattr(auth, "token_cache", auth.TokenCache())
+    token = jwt.encode({"sub": "7", "exp": int(time.time()) + 60}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert auth.decode_token(token)["sub"] == "7"
+    assert auth.token_cache.get(token)["sub"] == "7"
+
+    expired = jwt.encode({"sub": "7", "exp": int(time.time()) - 10}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    auth.token_cache.put(expired, {"sub": "7", "exp": int(time.time()) - 10})
+    with pytest.raises(auth.HTTPException) as exc:
+        auth.decode_token(expired)
+    assert exc.value.status_code == 401
+
+
+def test_optional_user_falls_back_to_default_on_stale_token(auth):
+    from fastapi.security import HTTPAuthorizationCredentials
+    from jose import jwt
+
+    expired = jwt.encode({"sub": "7", "exp": int(time.time()) - 10}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    live = jwt.encode({"sub": "7", "exp": int(time.time()) + 60}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    bearer = lambda token: HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)  # noqa: E731
+    assert auth.get_optional_user_id(None) == "default_user"
+    assert auth.get_optional_user_id(bearer(expired)) == "default_user"
+    assert auth.get_optional_user_id(bearer("not-a-jwt")) == "default_user"
+    assert auth.get_optional_user_id(bearer(live)) == "7"
@@ -0,0 +1,87 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from contracts import (COMPILED_TEMPLATES, CompiledTemplate, ContractValidationError, get_template,
+                       iter_batch_rows, render_batch, stream_ndjson, stream_zip)
+
+NDA = {
+    "party1_name": "Acme Ltd", "party1_address": "Mumbai",
+    "party2_name": "Beta LLP", "party2_address": "Pune",
+    "confidential_info": "trade secrets", "duration": "2 years",
+}
+
+
+def test_compiled_template_matches_str_format():
+    template = CompiledTemplate("t", "Test", "Dear {name}, pay {amount} by {date}.", {"amount": "₹100"})
+    assert template.placeholders == {"name", "amount", "date"}
+    assert template.required == {"name"}
+    rendered = template.render({"name": "Asha"}, today="May 01, 2025")
+    assert rendered == "Dear {name}, pay {amount} by {date}.".format(name="Asha", amount="₹100",
+                                                                     date="May 01, 2025")
+
+
+def test_compiled_template_rejects_format_specs():
+    with pytest.raises(ValueError):
+        CompiledTemplate("t", "Test", "{amount:>10}")
+
+
+def test_empty_strings_count_as_missing():
+    template = CompiledTemplate("t", "Test", "{a} {b}", {"b": "default"})
+    with pytest.raises(ContractValidationError) as exc:
+        template.render({"a": ""})
+    assert exc.value.errors == ["Missing required field: 'a'"]
+    # An empty value does not override a default either
+    assert template.render({"a": "x", "b": ""}) == "x default"
+
+
+def test_missing_fields_are_all_reported_sorted():
+    with pytest.raises(ContractValidationError) as exc:
+        get_template("nda").render({"party1_name": "Acme Ltd"})
+    assert exc.value.errors == [f"Missing required field: '{f}'"
+                                for f in sorted(COMPILED_TEMPLATES["nda"].required - {"party1_name"})]
+
+
+def test_unknown_template_type():
+    with pytest.raises(ContractValidationError):
+        get_template("lease")
+
+
+def test_render_batch_reports_errors_per_row():
+    rows = [
+        dict(NDA),
+        {**NDA, "duration": ""},
+        {"template_type": "lease"},
+        {"form_data": dict(NDA), "template_type": "nda"},
+        {"__error__": "Invalid JSON: Expecting value"},
+    ]
+    results = dict(render_batch(rows, "nda"))
+    assert [n for n, r in results.items() if r["ok"]] == [1, 4]
+    assert results[2]["errors"] == ["Missing required field: 'duration'"]
+    assert results[3]["errors"] == ["Invalid template type: 'lease'"]
+    assert results[5]["errors"] == ["Invalid JSON: Expecting value"]
+    assert "Acme Ltd" in results[1]["contract"]
+    assert results[1]["contract"] == results[4]["contract"]
+
+
+def test_iter_batch_rows_csv_and_jsonl():
+    csv_bytes = "\ufeffparty1_name, duration\nAcme , 2 years\n".encode("utf-8")
+    assert list(iter_batch_rows(io.BytesIO(csv_bytes), "csv")) == [{"party1_name": "Acme", "duration": "2 years"}]
+
+    jsonl = b'{"a": 1}\n\nnot json\n[1, 2]\n'
+    rows = list(iter_batch_rows(io.BytesIO(jsonl), "jsonl"))
+    assert rows[0] == {"a": 1}
+    assert rows[1]["__error__"].startswith("Invalid JSON")
+    assert rows[2] == {"__error__": "Row is not a JSON object"}
+
+
+def test_stream_outputs():
+    results = list(render_batch([dict(NDA), {}], "nda"))
+    lines = b"".join(stream_ndjson(results)).decode("utf-8").splitlines()
+    assert [json.loads(line)["ok"] for line in lines] == [True, False]
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(results, chunk_size=128))))
+    assert archive.namelist() == ["000001_nda.txt", "errors.json"]
+    assert [e["row"] for e in json.loads(archive.read("errors.json"))] == [2]
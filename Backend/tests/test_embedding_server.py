@@ -0,0 +1,114 @@
+import socket
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import embedding_server  # noqa: E402
+from embedding_server import (EmbeddingServerError, EncodeBatcher, pack_message, recv_frame,  # noqa: E402
+                              send_frame, unpack_message)
+
+
+class FakeModel:
+    """Encodes each text as [len(text), position in the batch]; records every call."""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def encode(self, texts, convert_to_numpy=True):
+        self.calls.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return np.array([[len(t), i] for i, t in enumerate(texts)], dtype=np.float32)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    def install(**kwargs):
+        model = FakeModel(**kwargs)
+        monkeypatch.setattr(embedding_server, "get_local_embedding_model", lambda: model)
+        return model
+    return install
+
+
+def test_message_round_trip_with_and_without_matrix():
+    obj, array = unpack_message(pack_message({"op": "search", "k": 3}))
+    assert obj == {"op": "search", "k": 3}
+    assert array is None
+
+    matrix = np.arange(6, dtype=np.float64).reshape(2, 3)
+    obj, array = unpack_message(pack_message({"tenant": "alice"}, matrix))
+    assert obj == {"tenant": "alice"}
+    assert array.dtype == np.float32
+    assert array.shape == (2, 3)
+    np.testing.assert_array_equal(array, matrix)
+
+    # A single vector travels as a one-row matrix
+    _, array = unpack_message(pack_message(None, np.ones(4)))
+    assert array.shape == (1, 4)
+
+
+def test_empty_matrix_round_trips():
+    obj, array = unpack_message(pack_message({}, np.zeros((0, 384))))
+    assert obj == {}
+    assert array.shape == (0, 384)
+
+
+def test_oversized_frame_is_rejected(monkeypatch):
+    monkeypatch.setattr(embedding_server, "MAX_FRAME_BYTES", 64)
+    left, right = socket.socketpair()
+    with left, right:
+        send_frame(left, embedding_server.OP_STATUS, pack_message({"ok": True}))
+        code, payload = recv_frame(right)
+        assert code == embedding_server.OP_STATUS
+        assert unpack_message(bytes(payload)) == ({"ok": True}, None)
+
+        send_frame(left, embedding_server.OP_ENCODE, pack_message({"texts": ["x" * 100]}))
+        with pytest.raises(EmbeddingServerError, match="exceeds"):
+            recv_frame(right)
+
+
+def test_batcher_coalesces_and_slices_per_request(fake_model):
+    model = fake_model()
+    batcher = EncodeBatcher(max_batch=100, max_wait_ms=500)
+    requests = [["a"], ["bb", "ccc"], ["dddd"]]
+    results = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def encode(i):
+        start.wait()
+        results[i] = batcher.encode(requests[i])
+
+    threads = [threading.Thread(target=encode, args=(i,)) for i in range(len(requests))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+
+    assert len(model.calls) == 1
+    assert sorted(model.calls[0]) == ["a", "bb", "ccc", "dddd"]
+    for texts, result in zip(requests, results):
+        assert result[:, 0].tolist() == [len(t) for t in texts]
+
+
+def test_batcher_model_error_reaches_every_waiter(fake_model):
+    fake_model(error=RuntimeError("model exploded"))
+    batcher = EncodeBatcher(max_batch=100, max_wait_ms=500)
+    errors = []
+    start = threading.Barrier(3)
+
+    def encode(texts):
+        start.wait()
+        try:
+            batcher.encode(texts)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=encode, args=([f"t{i}"],)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert errors == ["model exploded"] * 3
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+
+import pytest
+
+from jobs import JobLimitExceeded, JobManager
+
+
+def wait_for(manager, job_id, statuses=("succeeded", "failed", "cancelled"), timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id, include_result=True)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} stuck in {manager.get(job_id)['status']}")
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    managers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("workers", 2)
+        manager = JobManager(str(tmp_path / "jobs.db"), str(tmp_path / "job_data"), **kwargs)
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.shutdown()
+
+
+def test_job_runs_to_completion_and_cleans_up_input(make_manager):
+    manager = make_manager()
+
+    def handler(ctx, payload):
+        ctx.progress(0.5, "Halfway")
+        with open(os.path.join(ctx.input_dir, "input")) as f:
+            return {"echo": f.read(), "n": payload["n"]}
+
+    manager.register("echo", handler)
+    manager.start()
+    job_id = manager.submit("echo", "alice", {"n": 3},
+                            prepare=lambda d: open(os.path.join(d, "input"), "w").write("hello"))
+    job = wait_for(manager, job_id)
+    assert job["status"] == "succeeded"
+    assert job["progress"] == 1.0
+    assert job["result"] == {"echo": "hello", "n": 3}
+    assert not os.path.exists(manager.input_dir(job_id))
+    assert manager.get(job_id, user_id="mallory") is None
+    assert [j["job_id"] for j in manager.list("alice")] == [job_id]
+
+
+def test_handler_error_marks_job_failed(make_manager):
+    manager = make_manager()
+
+    def handler(ctx, payload):
+        raise ValueError("unreadable PDF")
+
+    manager.register("broken", handler)
+    manager.start()
+    job = wait_for(manager, manager.submit("broken", "alice", {}))
+    assert job["status"] == "failed"
+    assert job["error"] == "unreadable PDF"
+
+
+def test_per_user_active_job_limit(make_manager, monkeypatch):
+    manager = make_manager(max_per_user=1)
+    manager.register("noop", lambda ctx, payload: {})
+    monkeypatch.setattr(manager, "_enqueue", lambda job_id: None)  # jobs stay queued
+    manager.submit("noop", "alice", {})
+    with pytest.raises(JobLimitExceeded):
+        manager.submit("noop", "alice", {})
+    manager.submit("noop", "bob", {})
+
+
+
+def test_job_limit_holds_across_managers(make_manager, monkeypatch):
+    # Separate managers stand in for separate processes sharing the jobs database
+    managers = [make_manager(max_per_user=3) for _ in range(4)]
+    accepted, rejected = [], []
+    barrier = threading.Barrier(len(managers) * 3)
+
+    def submit(manager):
+        barrier.wait()
+        try:
+            accepted.append(manager.submit("noop", "alice", {}))
+        except JobLimitExceeded:
+            rejected.append(manager)
+
+    threads = []
+    for manager in managers:
+        manager.register("noop", lambda ctx, payload: {})
+        monkeypatch.setattr(manager, "_enqueue", lambda job_id: None)  # jobs stay queued
+        threads += [threading.Thread(target=submit, args=(manager,)) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(accepted) == 3
+    assert len(rejected) == 9
+
+def test_cancel_running_job_from_another_manager(make_manager):
+    started = threading.Event()
+
+    def handler(ctx, payload):
+        started.set()
+        for _ in range(250):
+            ctx.progress(0.1)
+            time.sleep(0.02)
+        return {}
+
+    runner, other = make_manager(), make_manager()
+    for manager in (runner, other):
+        manager.register("slow", handler)
+    runner.start()
+    job_id = runner.submit("slow", "alice", {})
+    assert started.wait(5)
+    # The runner may notice the flag before cancel() re-reads the row
+    assert other.cancel(job_id, "alice")["message"] in ("Cancellation requested", "Cancelled")
+    assert wait_for(runner, job_id)["status"] == "cancelled"
+
+
+def test_cancel_queued_job_never_runs(make_manager):
+    gate = threading.Event()
+    ran = []
+    manager = make_manager(workers=1)
+    manager.register("block", lambda ctx, payload: gate.wait(5) and {})
+    manager.register("record", lambda ctx, payload: ran.append(1) or {})
+    manager.start()
+    blocker = manager.submit("block", "alice", {})
+    queued = manager.submit("record", "alice", {})
+    assert manager.cancel(queued, "alice")["status"] == "cancelled"
+    gate.set()
+    assert wait_for(manager, blocker)["status"] == "succeeded"
+    assert manager.get(queued)["status"] == "cancelled"
+    assert ran == []
+
+
+def test_each_job_is_claimed_once_across_managers(make_manager):
+    runs = []
+    lock = threading.Lock()
+
+    def handler(ctx, payload):
+        with lock:
+            runs.append((payload["i"], ctx.manager.owner))
+        return {}
+
+    managers = [make_manager(max_per_user=100) for _ in range(3)]
+    for manager in managers:
+        manager.register("count", handler)
+        manager.start()
+    job_ids = [managers[i % 3].submit("count", "alice", {"i": i}) for i in range(12)]
+    for manager in managers:
+        manager.recover_expired()  # nothing has expired: no-op
+    for job_id in job_ids:
+        wait_for(managers[0], job_id)
+    assert sorted(i for i, _ in runs) == list(range(12))
+
+
+def test_expired_lease_is_taken_over(make_manager, monkeypatch):
+    # A process that dies after submitting: the job is never run and its lease is never renewed
+    dead = make_manager(lease_s=0.2)
+    dead.register("work", lambda ctx, payload: {})
+    monkeypatch.setattr(dead, "_enqueue", lambda job_id: None)
+    job_id = dead.submit("work", "alice", {})
+
+    survivor = make_manager(lease_s=0.2)
+    survivor.register("work", lambda ctx, payload: {"by": ctx.manager.owner})
+    assert survivor.recover_expired() == 0  # lease still valid
+    time.sleep(0.3)
+    survivor.start()  # takes over expired jobs on start
+    job = wait_for(survivor, job_id)
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"by": survivor.owner}
@@ -0,0 +1,87 @@
+import re
+
+from metrics import Histogram, MetricsRegistry, WindowedSeries
+
+
+def test_rollup_counts_only_slots_inside_the_window():
+    series = WindowedSeries(slot_seconds=60, slots=10)
+    now = 60 * 1000
+    series.record(1.0, now=now)
+    series.record(3.0, error=True, now=now - 60)
+    series.record(5.0, now=now - 5 * 60)
+
+    last_two_minutes = series.rollup(120, now=now)
+    assert last_two_minutes["count"] == 2
+    assert last_two_minutes["errors"] == 1
+    assert last_two_minutes["avg"] == 2.0
+    assert series.rollup(600, now=now)["count"] == 3
+
+
+def test_ring_slot_is_reused_after_wraparound():
+    series = WindowedSeries(slot_seconds=60, slots=4)
+    series.record(now=0)
+    series.record(now=4 * 60)  # same ring slot, four slots later
+    assert series.rollup(60, now=4 * 60)["count"] == 1
+    assert series.rollup(240, now=4 * 60)["count"] == 1
+
+
+def test_timeline_is_zero_filled_oldest_first():
+    series = WindowedSeries(slot_seconds=60, slots=10)
+    series.record(2.0, now=600)
+    points = series.timeline(180, now=600)
+    assert [p["ts"] for p in points] == [480, 540, 600]
+    assert [p["count"] for p in points] == [0, 0, 1]
+
+
+def test_histogram_quantile_interpolates_within_bucket():
+    hist = Histogram(buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        hist.observe(value)
+    counts, total, total_sum = hist.snapshot()
+    assert counts == [1, 2, 1, 0]
+    assert total == 4
+    assert total_sum == 6.5
+    assert 1.0 <= hist.quantile(0.5) <= 2.0
+
+
+def test_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.describe("jobs_total", "Jobs processed")
+    registry.counter("jobs_total", {"kind": "summarize"}).inc(2)
+    registry.gauge("queue_depth", fn=lambda: 3)
+    registry.histogram("latency_seconds", buckets=(0.1, 1.0)).observe(0.5)
+
+    text = registry.render_prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    assert "# HELP jobs_total Jobs processed" in lines
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{kind="summarize"} 2' in lines
+    assert "queue_depth 3" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 0' in lines
+    assert 'latency_seconds_bucket{le="1"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert "latency_seconds_count 1" in lines
+    # Every sample line is `name{labels} value`
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[^}]*\})? \S+$')
+    assert all(sample.match(line) for line in lines if not line.startswith("#"))
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", {"route": 'say "hi"\n'}).inc()
+    assert 'errors_total{route="say \\"hi\\"\\n"} 1' in registry.render_prometheus()
+
+
+def test_snapshot_has_a_timeline_per_event():
+    registry = MetricsRegistry()
+    registry.record_event("queries")
+    registry.record_event("queries")
+    registry.record_event("documents_analyzed")
+
+    snap = registry.snapshot("1h")
+    assert snap["events"]["queries"] == {"total": 2, "window": 2}
+    assert len(snap["event_timelines"]["queries"]) == 60
+    assert sum(p["count"] for p in snap["event_timelines"]["queries"]) == 2
+    assert sum(p["count"] for p in snap["event_timelines"]["documents_analyzed"]) == 1
+    assert sum(p["count"] for p in registry.snapshot("24h")["event_timelines"]["queries"]) == 2
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from rag_service import PartitionedLegalRAG  # noqa: E402
+
+
+def vec(*values):
+    return np.array([values], dtype="float32")
+
+
+def add(store, tenant, matter, text, vector):
+    with store.partition(tenant, matter) as rag:
+        rag.add_embeddings([text], vector, [{"source": text}])
+
+
+def search(store, tenant, vector, matters=None, k=5):
+    return store.search_similar("", tenant=tenant, matters=matters, k=k, rerank=False, query_embedding=vector)
+
+
+def test_search_never_crosses_tenants(tmp_path):
+    store = PartitionedLegalRAG(str(tmp_path))
+    add(store, "alice", "general", "alice lease", vec(1, 0, 0))
+    add(store, "bob", "general", "bob lease", vec(0, 1, 0))
+    add(store, "bob", "m-2", "bob merger", vec(0, 0, 1))
+
+    # Even a query that matches bob's chunks exactly only sees alice's partitions
+    hits = search(store, "alice", vec(0, 1, 0))
+    assert [h["page_content"] for h in hits] == ["alice lease"]
+    hits = search(store, "bob", vec(0, 0, 1))
+    assert [h["page_content"] for h in hits] == ["bob merger", "bob lease"]
+    assert hits[0]["metadata"]["matter"] == "m-2"
+
+
+def test_unknown_matter_is_not_created(tmp_path):
+    store = PartitionedLegalRAG(str(tmp_path))
+    add(store, "alice", "general", "alice lease", vec(1, 0))
+
+    assert search(store, "alice", vec(1, 0), matters=["missing"]) == []
+    assert search(store, "carol", vec(1, 0)) == []
+    assert not store.has_partition("alice", "missing")
+    assert not os.path.exists(store.partition_dir("alice", "missing"))
+    assert store.list_matters("alice") == ["general"]
+
+
+def test_lru_eviction_saves_dirty_partitions(tmp_path):
+    store = PartitionedLegalRAG(str(tmp_path), memory_budget_mb=0)
+    add(store, "alice", "general", "alice lease", vec(1, 0))
+
+    # Over budget (0 MB) as soon as the partition is released: saved, then dropped
+    assert ("alice", "general") not in store._partitions
+    assert store.has_partition("alice", "general")
+    hits = search(store, "alice", vec(1, 0))
+    assert [h["page_content"] for h in hits] == ["alice lease"]
+
+    reopened = PartitionedLegalRAG(str(tmp_path))
+    assert [h["page_content"] for h in search(reopened, "alice", vec(1, 0))] == ["alice lease"]
+
+
+def test_pinned_partition_is_not_evicted(tmp_path):
+    store = PartitionedLegalRAG(str(tmp_path), memory_budget_mb=0)
+    with store.partition("alice", "general") as rag:
+        rag.add_embeddings(["alice lease"], vec(1, 0), [{}])
+        add(store, "bob", "general", "bob lease", vec(0, 1))
+        # bob's release ran the eviction pass: bob went, the in-use partition stayed
+        assert ("bob", "general") not in store._partitions
+        assert store._partitions[("alice", "general")] is rag
+        assert rag.documents == ["alice lease"]
+    assert ("alice", "general") not in store._partitions
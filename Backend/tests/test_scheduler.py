@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from scheduler import LLMOverloaded, LLMScheduler, PriorityClass
+
+
+def make_scheduler(max_concurrency=1, max_queue=8, max_wait_s=60.0, service_s=0.01):
+    scheduler = LLMScheduler(max_concurrency, {
+        "interactive": PriorityClass("interactive", 0, max_queue, max_wait_s),
+        "batch": PriorityClass("batch", 1, max_queue, max_wait_s),
+    })
+    scheduler._avg_service_s = service_s
+    return scheduler
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_sheds_when_class_queue_is_full():
+    scheduler = make_scheduler(max_queue=1)
+
+    async def scenario():
+        scheduler.acquire()  # the only slot
+        waiter = asyncio.ensure_future(scheduler.acquire_async())
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded) as exc:
+            await scheduler.acquire_async()
+        assert exc.value.retry_after >= 1
+        scheduler.release()
+        await waiter
+        scheduler.release()
+
+    run(scenario())
+    assert scheduler._active == 0
+
+
+def test_sheds_when_expected_wait_exceeds_deadline():
+    scheduler = make_scheduler(max_wait_s=1.0, service_s=5.0)
+
+    async def scenario():
+        scheduler.acquire()
+        with pytest.raises(LLMOverloaded):
+            await scheduler.acquire_async()
+        # Background work is never shed; it waits for the slot
+        waiter = asyncio.ensure_future(scheduler.acquire_async("batch", shed=False))
+        await asyncio.sleep(0)
+        scheduler.release()
+        await waiter
+        scheduler.release()
+
+    run(scenario())
+
+
+def test_queued_call_expires_at_its_deadline():
+    scheduler = make_scheduler(max_wait_s=0.1)
+
+    async def scenario():
+        scheduler.acquire()
+        with pytest.raises(LLMOverloaded):
+            await scheduler.acquire_async()
+        assert scheduler._depth["interactive"] == 0
+        scheduler.release()
+
+    run(scenario())
+    assert scheduler._active == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = make_scheduler()
+
+    async def scenario():
+        scheduler.acquire()
+        waiter = asyncio.ensure_future(scheduler.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler._depth["interactive"] == 0
+        scheduler.release()
+
+    run(scenario())
+    assert scheduler._active == 0
+
+
+def test_round_robin_across_users_and_priority_between_classes():
+    scheduler = make_scheduler()
+    served = []
+
+    async def call(priority, user):
+        async with scheduler.slot_async(priority, user, shed=False):
+            served.append((priority, user))
+
+    async def scenario():
+        scheduler.acquire()
+        tasks = [asyncio.ensure_future(call("batch", "bulk"))]
+        await asyncio.sleep(0)
+        for user in ("alice", "alice", "alice", "bob"):
+            tasks.append(asyncio.ensure_future(call("interactive", user)))
+            await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    run(scenario())
+    assert served == [("interactive", "alice"), ("interactive", "bob"), ("interactive", "alice"),
+                      ("interactive", "alice"), ("batch", "bulk")]
+
+
+def test_blocking_slot_releases_on_error():
+    scheduler = make_scheduler(max_concurrency=2)
+    with pytest.raises(RuntimeError):
+        with scheduler.slot("batch", shed=False):
+            assert scheduler._active == 1
+            raise RuntimeError("gemini failed")
+    assert scheduler._active == 0
@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("multipart")
+
+from fastapi import HTTPException, Request  # noqa: E402
+
+from uploads import receive_upload, require_file  # noqa: E402
+
+BOUNDARY = "testboundary"
+
+
+def multipart_body(content: bytes, filename: str = "doc.txt", fields=None) -> bytes:
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n")
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+
+def make_request(body: bytes, content_length: bool = True, chunk_size: int = 1024) -> Request:
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+
+
+def test_file_is_spooled_with_size_and_hash():
+    content = b"clause " * 5000
+    form = asyncio.run(receive_upload(make_request(multipart_body(content, fields={"matter": "m-1"})),
+                                      spool_bytes=1024))
+    try:
+        upload = require_file(form)
+        assert upload.filename == "doc.txt"
+        assert upload.size == len(content)
+        assert upload.sha256 == hashlib.sha256(content).hexdigest()
+        assert upload.read() == content
+        assert form.fields == {"matter": "m-1"}
+    finally:
+        form.close()
+
+
+def test_rejects_on_content_length_before_reading():
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(receive_upload(make_request(multipart_body(b"x" * 4096)), max_bytes=1024))
+    assert exc.value.status_code == 413
+
+
+def test_rejects_mid_stream_without_content_length():
+    request = make_request(multipart_body(b"x" * 4096), content_length=False, chunk_size=512)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(receive_upload(request, max_bytes=1024))
+    assert exc.value.status_code == 413
+
+
+def test_missing_file_field_is_422():
+    body = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="matter"\r\n\r\nx\r\n--{BOUNDARY}--\r\n'.encode()
+    form = asyncio.run(receive_upload(make_request(body)))
+    with pytest.raises(HTTPException) as exc:
+        require_file(form)
+    assert exc.value.status_code == 422
+
+
+def test_rolled_over_writes_leave_the_event_loop(monkeypatch):
+    import uploads
+
+    offloaded = []
+
+    async def fake_threadpool(func, *args):
+        offloaded.append(func)
+        return func(*args)
+
+    monkeypatch.setattr(uploads, "run_in_threadpool", fake_threadpool)
+    content = bytes(range(256)) * 64
+    form = asyncio.run(receive_upload(make_request(multipart_body(content)), spool_bytes=4096))
+    try:
+        upload = require_file(form)
+        assert upload.file._rolled
+        assert upload.read() == content
+        assert offloaded
+    finally:
+        form.close()
@@ -0,0 +1,171 @@
+"""
+Per-request stage tracing and an opt-in sampling profiler.
+
+Every `metrics.stage(...)` block also records a span on the current request's
+trace (a context variable, so it follows the request into run_in_threadpool
+workers). The middleware renders the spans as a Server-Timing header:
+
+    Server-Timing: extraction;dur=812.4, embedding;dur=95.1;desc="x2", gemini_call;dur=2310.0, total;dur=3241.7
+
+Profiling is off unless a request sends `X-Profile: <PROFILE_TOKEN>` or is
+picked by PROFILE_SAMPLE_RATE. A profiled request runs a background thread
+that samples every thread's Python stack each PROFILE_INTERVAL_MS and writes
+the result in collapsed-stack format (one `frame;frame;frame count` line per
+stack) to PROFILE_DIR, ready for flamegraph.pl, speedscope or inferno. When
+profiling is off nothing runs beyond one header lookup.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "1") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_HEADER = "x-profile"
+
+# Innermost frames in these modules mean the thread is parked, not working
+_IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "base_events.py")
+
+
+class RequestTrace:
+    """Spans of one request, aggregated by stage name (total seconds, count)."""
+
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self, total_seconds: Optional[float] = None) -> str:
+        parts = []
+        for name, (seconds, count) in list(self.spans.items()):
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                part += f';desc="x{count}"'
+            parts.append(part)
+        if total_seconds is not None:
+            parts.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def start_trace():
+    """Starts a trace for the current request; returns the token for end_trace."""
+    return _current_trace.set(RequestTrace())
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+def record_span(name: str, seconds: float):
+    """Adds a span to the current request's trace (no-op outside a request)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+# ---------- Sampling profiler ----------
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Samples all thread stacks from a daemon thread and writes collapsed stacks."""
+
+    def __init__(self, label: str, interval_ms: float = PROFILE_INTERVAL_MS,
+                 max_seconds: float = PROFILE_MAX_SECONDS, out_dir: str = PROFILE_DIR):
+        self.label = label
+        self.interval = interval_ms / 1000.0
+        self.max_seconds = max_seconds
+        self.out_dir = out_dir
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.stacks: StackCounter = StackCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.profile_id}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> str:
+        """Stops sampling and writes the collapsed stacks; returns the output path."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.makedirs(self.out_dir, exist_ok=True)
+        safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.label).strip("_")
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}-{self.profile_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+_profile_lock = threading.Lock()
+
+
+def maybe_start_profiler(headers, label: str) -> Optional[SamplingProfiler]:
+    """Starts a profiler if this request asked for one (admin header) or was sampled.
+
+    Only one request is profiled at a time, since samples cover every thread.
+    """
+    requested = bool(PROFILE_TOKEN) and headers.get(PROFILE_HEADER) == PROFILE_TOKEN
+    if not requested and not (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = SamplingProfiler(label)
+    profiler.start()
+    return profiler
+
+
+def finish_profiler(profiler: SamplingProfiler) -> str:
+    try:
+        return profiler.stop()
+    finally:
+        _profile_lock.release()
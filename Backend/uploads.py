@@ -0,0 +1,206 @@
+"""
+Streaming, size-bounded upload handling.
+
+`receive_upload` parses the multipart body as it arrives instead of letting
+the framework buffer it: file parts are written straight into a spooled
+temporary file (memory up to UPLOAD_SPOOL_MB, disk beyond), hashed
+incrementally, and the request is rejected with 413 as soon as it crosses
+the size limit. Handlers get a seekable file handle plus the SHA-256 of
+the content, so caches can be consulted before any parsing happens.
+
+The parser callbacks only buffer file data; it is written out after each
+network chunk, on the event loop while the spool is still in memory and
+in the threadpool once it has rolled over to disk.
+"""
+import hashlib
+import os
+from tempfile import SpooledTemporaryFile
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from multipart.multipart import MultipartParser, parse_options_header
+
+from metrics import metrics
+
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "100"))
+UPLOAD_SPOOL_MB = int(os.getenv("UPLOAD_SPOOL_MB", "2"))
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+
+class SpooledUpload:
+    """An uploaded file held in a spooled temp file, with its size and content hash."""
+
+    def __init__(self, filename: str, spool_bytes: int):
+        self.filename = filename
+        self.file = SpooledTemporaryFile(max_size=spool_bytes)
+        self.size = 0
+        self._spool_bytes = spool_bytes
+        self._pending: List[bytes] = []
+        self._hasher = hashlib.sha256()
+        self.sha256: Optional[str] = None
+
+    def write(self, data: bytes):
+        """Buffers data; it reaches the spooled file on the next flush()."""
+        self._pending.append(data)
+        self._hasher.update(data)
+        self.size += len(data)
+
+    @property
+    def on_disk(self) -> bool:
+        """True once flushing touches the filesystem (the spool has rolled over, or will)."""
+        return self.size > self._spool_bytes
+
+    def flush(self):
+        if self._pending:
+            data = b"".join(self._pending)
+            self._pending.clear()
+            self.file.write(data)
+
+    def finish(self):
+        self.flush()
+        self.sha256 = self._hasher.hexdigest()
+        self.file.seek(0)
+
+    def open(self):
+        """Returns the underlying handle rewound to the start (for parsers)."""
+        self.file.seek(0)
+        return self.file
+
+    def read(self) -> bytes:
+        return self.open().read()
+
+    def close(self):
+        self.file.close()
+
+
+class ParsedForm:
+    """Result of receive_upload: uploaded files (by field name) and plain form fields."""
+
+    def __init__(self):
+        self.files: Dict[str, List[SpooledUpload]] = {}
+        self.fields: Dict[str, str] = {}
+
+    def close(self):
+        for uploads in self.files.values():
+            for upload in uploads:
+                upload.close()
+
+
+def _too_large(limit: int):
+    metrics.counter("upload_rejected_total", {"reason": "too_large"}).inc()
+    raise HTTPException(413, f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+
+
+async def receive_upload(request: Request, max_bytes: Optional[int] = None,
+                         spool_bytes: Optional[int] = None) -> ParsedForm:
+    """Streams a multipart/form-data request body into spooled files.
+
+    Rejects early: on Content-Length before reading anything, and mid-stream
+    as soon as the received body crosses `max_bytes`.
+    """
+    max_bytes = max_bytes or MAX_UPLOAD_MB * 1024 * 1024
+    spool_bytes = spool_bytes or UPLOAD_SPOOL_MB * 1024 * 1024
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        _too_large(max_bytes)
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(400, "Expected a multipart/form-data upload")
+
+    form = ParsedForm()
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "name": None,
+             "upload": None, "field": bytearray()}
+    # Uploads that received data during the current parser.write
+    touched: List[SpooledUpload] = []
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["name"], state["upload"] = None, None
+        state["field"] = bytearray()
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"], state["header_value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["name"] = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if b"filename" in options:
+            filename = os.path.basename(options[b"filename"].decode("utf-8", errors="replace"))
+            state["upload"] = SpooledUpload(filename, spool_bytes)
+
+    def on_part_data(data, start, end):
+        upload = state["upload"]
+        if upload is not None:
+            upload.write(data[start:end])
+            if not touched or touched[-1] is not upload:
+                touched.append(upload)
+        else:
+            state["field"] += data[start:end]
+            if len(state["field"]) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(413, f"Form field '{state['name']}' is too large")
+
+    def on_part_end():
+        upload = state["upload"]
+        if upload is not None:
+            form.files.setdefault(state["name"], []).append(upload)
+        elif state["name"] is not None:
+            form.fields[state["name"]] = state["field"].decode("utf-8", errors="replace")
+
+    async def flush_touched():
+        for upload in touched:
+            if upload.on_disk:
+                await run_in_threadpool(upload.flush)
+            else:
+                upload.flush()
+        touched.clear()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    received = 0
+    try:
+        with metrics.stage("upload_receive"):
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_bytes:
+                    _too_large(max_bytes)
+                parser.write(chunk)
+                await flush_touched()
+            parser.finalize()
+            await flush_touched()
+            # Everything is flushed by now, so finish() only hashes and rewinds
+            for uploads in form.files.values():
+                for upload in uploads:
+                    upload.finish()
+    except BaseException:
+        form.close()
+        if state["upload"] is not None:
+            state["upload"].close()
+        raise
+    metrics.histogram("upload_size_bytes", buckets=(1e4, 1e5, 1e6, 5e6, 2e7, 5e7, 1e8, 5e8)).observe(received)
+    return form
+
+
+def require_file(form: ParsedForm, field: str = "file") -> SpooledUpload:
+    uploads = form.files.get(field)
+    if not uploads:
+        form.close()
+        raise HTTPException(422, f"Missing file field '{field}'")
+    return uploads[0]
@@ -4,6 +4,7 @@ import {
   BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, 
   LineChart, Line, CartesianGrid, PieChart, Pie, Cell
 } from 'recharts';
+import { getMetrics } from '../services/api';
 
 const Card = ({ children, className = "" }) => (
   <div className={`bg-white rounded-2xl p-6 shadow-lg border border-gray-200 ${className}`}>
@@ -37,7 +38,7 @@ const ClockIcon = () => (
 );
 
 export default function AnalyticsDashboard() {
-  const [timeRange, setTimeRange] = useState('7d'); // 7d, 30d, 90d
+  const [timeRange, setTimeRange] = useState('24h'); // 5m, 1h, 24h (the backend's rollup windows)
   const [loading, setLoading] = useState(true);
 
   // Mock data - In real app, yeh API se aayega
@@ -54,17 +55,36 @@ export default function AnalyticsDashboard() {
     recentActivity: []
   });
 
-  // Simulate data loading
+  // Load live metrics from backend, fall back to mock data if unavailable
   useEffect(() => {
-    const loadDashboardData = () => {
+    const loadDashboardData = async () => {
       setLoading(true);
-      
-      // Simulate API call delay
-      setTimeout(() => {
-        const mockData = generateMockData(timeRange);
+      const mockData = generateMockData(timeRange);
+      try {
+        const live = await getMetrics(timeRange);
+        const events = live.events || {};
+        const inWindow = (name) => (events[name] ? events[name].window : 0);
+        // Per-event timelines share the same buckets as the overall timeline
+        const eventTimelines = live.event_timelines || {};
+        const countAt = (name, i) => (eventTimelines[name] ? eventTimelines[name][i].count : 0);
+        setDashboardData({
+          ...mockData,
+          stats: {
+            ...mockData.stats,
+            totalQueries: inWindow('queries'),
+            documentsAnalyzed: inWindow('documents_analyzed') + inWindow('uploads'),
+            avgResponseTime: Number((live.requests.avg || 0).toFixed(2))
+          },
+          usageTrend: live.timeline.map((point, i) => ({
+            day: new Date(point.ts * 1000).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }),
+            queries: countAt('queries', i),
+            documents: countAt('documents_analyzed', i) + countAt('uploads', i)
+          }))
+        });
+      } catch (err) {
         setDashboardData(mockData);
-        setLoading(false);
-      }, 1000);
+      }
+      setLoading(false);
     };
 
     loadDashboardData();
@@ -72,8 +92,8 @@ export default function AnalyticsDashboard() {
 
   // Mock data generator
   const generateMockData = (range) => {
-    const baseQueries = range === '7d' ? 1842 : range === '30d' ? 7580 : 21500;
-    const baseUsers = range === '7d' ? 247 : range === '30d' ? 890 : 2500;
+    const baseQueries = range === '5m' ? 12 : range === '1h' ? 96 : 1842;
+    const baseUsers = range === '5m' ? 6 : range === '1h' ? 38 : 247;
     
     return {
       stats: {
@@ -126,12 +146,12 @@ export default function AnalyticsDashboard() {
   };
 
   const generateTrendData = (range) => {
-    const days = range === '7d' ? 7 : range === '30d' ? 30 : 90;
+    const points = range === '5m' ? 5 : range === '1h' ? 60 : 24;
     const data = [];
     
-    for (let i = 0; i < days; i++) {
+    for (let i = 0; i < points; i++) {
       data.push({
-        day: `Day ${i + 1}`,
+        day: range === '24h' ? `Hour ${i + 1}` : `Min ${i + 1}`,
         queries: Math.floor(50 + Math.random() * 100),
         documents: Math.floor(15 + Math.random() * 30)
       });
@@ -215,7 +235,7 @@ export default function AnalyticsDashboard() {
         
         {/* Time Range Selector */}
         <div className="flex space-x-2 bg-white/10 backdrop-blur-sm rounded-xl p-1">
-          {['7d', '30d', '90d'].map((range) => (
+          {['5m', '1h', '24h'].map((range) => (
             <button
               key={range}
               onClick={() => setTimeRange(range)}
@@ -225,7 +245,7 @@ export default function AnalyticsDashboard() {
                   : 'text-white hover:bg-white/20'
               }`}
             >
-              {range === '7d' ? '7 Days' : range === '30d' ? '30 Days' : '90 Days'}
+              {range === '5m' ? '5 Min' : range === '1h' ? '1 Hour' : '24 Hours'}
             </button>
           ))}
         </div>
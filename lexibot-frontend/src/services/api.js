@@ -8,6 +8,27 @@ const api = axios.create({
   timeout: 30000,
 });
 
+// Send the login token so chat history is kept per user
+api.interceptors.request.use((config) => {
+  const token = localStorage.getItem('token');
+  if (token) {
+    config.headers.Authorization = `Bearer ${token}`;
+  }
+  return config;
+});
+
+// A 401 means the stored token is expired or invalid: drop it so later
+// requests go out anonymously instead of failing the same way
+api.interceptors.response.use(
+  (response) => response,
+  (error) => {
+    if (error.response?.status === 401) {
+      localStorage.removeItem('token');
+    }
+    return Promise.reject(error);
+  }
+);
+
 export const ragChat = async (query) => {
   const response = await api.post('/api/rag-chat', { query });
   return response.data;
@@ -36,4 +57,8 @@ export const summarizeDocument = async (file) => {
     headers: { 'Content-Type': 'multipart/form-data' }
   });
   return response.data;
-};
\ No newline at end of file
+};
+export const getMetrics = async (window = '24h') => {
+  const response = await api.get('/api/metrics', { params: { window } });
+  return response.data;
+};